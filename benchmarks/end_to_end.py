@@ -0,0 +1,135 @@
+"""Run the tap end to end against the local API simulator and report the
+requests it made, wall time, peak memory and records per second.
+
+    python benchmarks/end_to_end.py --technicians 200 --days 28
+    python benchmarks/end_to_end.py --config '{"report_workers": 4}'
+
+The tap runs in a child process, discovery first and then a sync of every
+stream, so its memory isn't mixed up with the simulator's. The simulator
+options are the same as `benchmarks/simulator.py`'s."""
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import simulator
+
+TAP = [sys.executable, '-c', 'import tap_logmeinrescue; '
+                             'tap_logmeinrescue.main()']
+
+
+def run_tap(arguments, stdout):
+    """Run the tap, returning its wall time and peak RSS in bytes."""
+    started = time.perf_counter()
+    process = subprocess.Popen(TAP + arguments, stdout=stdout)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+
+    if os.WEXITSTATUS(status) != 0:
+        raise SystemExit('The tap exited with {}'
+                         .format(os.WEXITSTATUS(status)))
+
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS.
+    scale = 1 if sys.platform == 'darwin' else 1024
+
+    return elapsed, usage.ru_maxrss * scale
+
+
+def select_all(catalog):
+    for stream in catalog['streams']:
+        for mdata in stream['metadata']:
+            if mdata['breadcrumb'] == []:
+                mdata['metadata']['selected'] = True
+
+    return catalog
+
+
+def count_messages(path):
+    records = states = 0
+
+    with open(path, 'rb') as handle:
+        for line in handle:
+            message_type = json.loads(line)['type']
+
+            if message_type == 'RECORD':
+                records += 1
+            elif message_type == 'STATE':
+                states += 1
+
+    return records, states
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=float, default=28,
+                        help='sync reports for this many days back')
+    parser.add_argument('--config', default='{}',
+                        help='JSON object of extra tap config')
+    simulator.add_arguments(parser)
+    args = parser.parse_args()
+
+    simulation = simulator.from_arguments(args)
+    server = simulator.start(simulation)
+
+    with tempfile.TemporaryDirectory() as directory:
+        start_date = datetime.datetime.utcnow() - \
+            datetime.timedelta(days=args.days)
+        config = {
+            'username': 'benchmark@example.com',
+            'password': 'benchmark',
+            'start_date': start_date.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'api_base_url': simulator.base_url(server),
+            'schema_cache_ttl_hours': 0,
+            'retry_base_seconds': 0.1,
+            'retry_max_seconds': 1,
+        }
+        config.update(json.loads(args.config))
+
+        paths = {name: os.path.join(directory, name)
+                 for name in ('config.json', 'catalog.json', 'output')}
+
+        with open(paths['config.json'], 'w') as handle:
+            json.dump(config, handle)
+
+        with open(paths['catalog.json'], 'w') as handle:
+            run_tap(['--config', paths['config.json'], '--discover'], handle)
+
+        with open(paths['catalog.json']) as handle:
+            catalog = select_all(json.load(handle))
+
+        with open(paths['catalog.json'], 'w') as handle:
+            json.dump(catalog, handle)
+
+        discovery_calls = simulation.total_calls()
+        simulation.calls.clear()
+        simulation.throttled = 0
+
+        with open(paths['output'], 'w') as handle:
+            elapsed, peak_rss = run_tap(
+                ['--config', paths['config.json'],
+                 '--catalog', paths['catalog.json']], handle)
+
+        records, states = count_messages(paths['output'])
+
+    server.shutdown()
+
+    print('discovery requests  {}'.format(discovery_calls))
+    print('sync requests       {}'.format(simulation.total_calls()))
+
+    for endpoint, calls in sorted(simulation.calls.items()):
+        print('  {:<18}{}'.format(endpoint, calls))
+
+    print('throttled (429)     {}'.format(simulation.throttled))
+    print('records             {}'.format(records))
+    print('state messages      {}'.format(states))
+    print('wall time           {:.2f}s'.format(elapsed))
+    print('peak RSS            {:.1f} MiB'.format(peak_rss / 1024 / 1024))
+    print('records/s           {:,.0f}'.format(records / elapsed))
+
+
+if __name__ == '__main__':
+    main()
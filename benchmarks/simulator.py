@@ -0,0 +1,316 @@
+"""A local stand-in for the LogMeIn Rescue API.
+
+Implements the endpoints the tap calls: login, getHierarchy_v2, the report
+set* calls and getReport_v2, with a configurable number of technicians,
+rows per report, columns, latency and injected 429s. Point the tap at it
+with `api_base_url`:
+
+    python benchmarks/simulator.py --port 8080 --technicians 200
+    {"api_base_url": "http://127.0.0.1:8080/API", ...}
+
+It isn't a faithful copy of the API: reports return `rows` rows per
+technician for any window, with made up values."""
+import argparse
+import collections
+import datetime
+import gzip
+import http.cookies
+import http.server
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+from xml.sax.saxutils import escape
+
+REPORT_SETTINGS = ('setReportArea_v8', 'setTimezone', 'setReportDate_v2',
+                   'setOutput')
+REPORT_DATE_FORMAT = '%m/%d/%Y %H:%M:%S'
+COMPANY_ID = 1
+
+
+class Simulation:
+    """The simulated account and the counters of what was asked of it."""
+
+    def __init__(self, technicians=20, technicians_per_group=50, rows=3,
+                 columns=8, column_width=12, latency=0.0, p429=0.0,
+                 retry_after=0.1, session_requests=None, seed=0):
+        self.technicians = technicians
+        self.technicians_per_group = technicians_per_group
+        self.rows = rows
+        self.columns = columns
+        self.column_width = column_width
+        self.latency = latency
+        self.p429 = p429
+        self.retry_after = retry_after
+        self.session_requests = session_requests
+        self.random = random.Random(seed)
+
+        self.sessions = {}
+        self.calls = collections.Counter()
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+        self.groups = {}
+
+        for index in range(technicians):
+            group_id = 10 + index // technicians_per_group
+            self.groups.setdefault(group_id, []).append(1000 + index)
+
+    def technicians_under(self, node_id):
+        if node_id == COMPANY_ID:
+            return [technician_id
+                    for members in self.groups.values()
+                    for technician_id in members]
+
+        if node_id in self.groups:
+            return self.groups[node_id]
+
+        if any(node_id in members for members in self.groups.values()):
+            return [node_id]
+
+        return None
+
+    def hierarchy(self):
+        nodes = [('Company', 'MasterAdministrator', COMPANY_ID, 0, 'Online')]
+
+        for group_id, members in sorted(self.groups.items()):
+            nodes.append(('Group {}'.format(group_id), 'TechnicianGroup',
+                          group_id, COMPANY_ID, ''))
+            nodes += [('Technician {}'.format(technician_id), 'Technician',
+                       technician_id, group_id, 'Offline')
+                      for technician_id in members]
+
+        blocks = ['OK']
+
+        for name, node_type, node_id, parent_id, status in nodes:
+            blocks.append('\n'.join([
+                'NodeID:{}'.format(node_id),
+                'Name:{}'.format(name),
+                'Type:{}'.format(node_type),
+                'ParentID:{}'.format(parent_id),
+                'Email:{}@example.com'.format(node_id),
+                'Description:',
+                'Status:{}'.format(status),
+            ]))
+
+        return '\n\n'.join(blocks) + '\n\n'
+
+    def report(self, settings, node_id):
+        technician_ids = self.technicians_under(node_id)
+
+        if technician_ids is None:
+            return 'INVALID_NODE\n\n'
+
+        dates = settings['setReportDate_v2']
+        start = datetime.datetime.strptime(dates['bdate'], REPORT_DATE_FORMAT)
+        end = datetime.datetime.strptime(dates['edate'], REPORT_DATE_FORMAT)
+        area = settings['setReportArea_v8']['area']
+
+        headers = ['Session ID', 'Start Time', 'Technician ID',
+                   'Technician Name']
+        headers += ['Custom Field {}'.format(i) for i in range(self.columns)]
+
+        parts = ['OK\n\n<report><header>']
+        parts += ['<field id="{}">{}</field>'.format(i, escape(header))
+                  for i, header in enumerate(headers)]
+        parts.append('</header><data>')
+
+        filler = 'x' * self.column_width
+        span = max((end - start).total_seconds(), 1)
+
+        for technician_id in technician_ids:
+            for row in range(self.rows):
+                started = start + datetime.timedelta(
+                    seconds=span * (row + 0.5) / self.rows)
+                values = [
+                    str(technician_id * 100000 + row),
+                    started.strftime('%Y-%m-%d %H:%M:%S'),
+                    str(technician_id),
+                    'Technician {}'.format(technician_id),
+                ]
+                values += ['{}-{}-{}'.format(area, i, filler)
+                           for i in range(self.columns)]
+
+                parts.append('<row>{}</row>'.format(''.join(
+                    '<field id="{}">{}</field>'.format(i, escape(value))
+                    for i, value in enumerate(values))))
+
+        parts.append('</data></report>')
+
+        return ''.join(parts)
+
+    def handle(self, endpoint, params, session_id):
+        """Return `(status code, body, new session id, headers)`."""
+        with self.lock:
+            self.calls[endpoint] += 1
+            throttle = self.p429 and endpoint != 'login' and \
+                self.random.random() < self.p429
+
+            if throttle:
+                self.throttled += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if throttle:
+            return 429, 'Too many requests', None, \
+                {'Retry-After': str(self.retry_after)}
+
+        if endpoint == 'login':
+            session_id = uuid.uuid4().hex
+
+            with self.lock:
+                self.sessions[session_id] = {'requests': 0}
+
+            return 200, 'OK\n\n', session_id, {}
+
+        with self.lock:
+            session = self.sessions.get(session_id)
+
+            if session is not None:
+                session['requests'] += 1
+
+                if self.session_requests and \
+                   session['requests'] > self.session_requests:
+                    del self.sessions[session_id]
+                    session = None
+
+        if session is None:
+            return 200, 'NOTLOGGEDIN\n\n', None, {}
+
+        if endpoint in REPORT_SETTINGS:
+            session[endpoint] = params
+            return 200, 'OK\n\n', None, {}
+
+        if endpoint == 'getHierarchy_v2':
+            return 200, self.hierarchy(), None, {}
+
+        if endpoint == 'getReport_v2':
+            missing = [name for name in REPORT_SETTINGS
+                       if name not in session]
+
+            if missing:
+                return 200, 'NOT_CONFIGURED\n\n', None, {}
+
+            return 200, self.report(session, int(params['node'])), None, {}
+
+        return 404, 'UNKNOWN_ENDPOINT\n\n', None, {}
+
+    def total_calls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+
+def make_handler(simulation):
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body are written separately, with Nagle's algorithm
+        # on every keep-alive response would wait on a delayed ACK.
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            params = dict(urllib.parse.parse_qsl(url.query))
+            endpoint = url.path.rsplit('/', 1)[-1].split('.')[0]
+
+            cookies = http.cookies.SimpleCookie(self.headers.get('Cookie'))
+            session_id = cookies['ASP.NET_SessionId'].value \
+                if 'ASP.NET_SessionId' in cookies else None
+
+            code, body, new_session_id, headers = simulation.handle(
+                endpoint, params, session_id)
+
+            body = body.encode('utf-8')
+
+            self.send_response(code)
+
+            if new_session_id is not None:
+                self.send_header(
+                    'Set-Cookie',
+                    'ASP.NET_SessionId={}; path=/'.format(new_session_id))
+
+            for name, value in headers.items():
+                self.send_header(name, value)
+
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                body = gzip.compress(body, compresslevel=1)
+                self.send_header('Content-Encoding', 'gzip')
+
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_POST = do_GET
+
+    return Handler
+
+
+def start(simulation, port=0):
+    """Serve `simulation` on a background thread, returning the server.
+    Its API base URL is `base_url(server)`."""
+    server = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', port), make_handler(simulation))
+    server.daemon_threads = True
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def base_url(server):
+    return 'http://127.0.0.1:{}/API'.format(server.server_port)
+
+
+def add_arguments(parser):
+    parser.add_argument('--technicians', type=int, default=20)
+    parser.add_argument('--technicians-per-group', type=int, default=50)
+    parser.add_argument('--rows', type=int, default=3,
+                        help='rows per technician in each report')
+    parser.add_argument('--columns', type=int, default=8,
+                        help='custom columns in each report')
+    parser.add_argument('--column-width', type=int, default=12)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every response')
+    parser.add_argument('--p429', type=float, default=0.0,
+                        help='share of requests answered with a 429')
+    parser.add_argument('--retry-after', type=float, default=0.1)
+    parser.add_argument('--session-requests', type=int, default=None,
+                        help='expire API sessions after this many requests')
+
+
+def from_arguments(args):
+    return Simulation(
+        technicians=args.technicians,
+        technicians_per_group=args.technicians_per_group,
+        rows=args.rows,
+        columns=args.columns,
+        column_width=args.column_width,
+        latency=args.latency,
+        p429=args.p429,
+        retry_after=args.retry_after,
+        session_requests=args.session_requests)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8080)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = start(from_arguments(args), args.port)
+    print('Serving the API at {}'.format(base_url(server)))
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
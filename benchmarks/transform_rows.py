@@ -0,0 +1,116 @@
+"""Compare the per-row `transform_record` path with the compiled
+`RowTransformer` on a synthetic report, after it's been parsed.
+
+    python benchmarks/transform_rows.py [--rows 20000] [--stream NAME]
+
+Both paths are fed the same rows and must produce the same records."""
+import argparse
+import random
+import time
+
+import singer
+
+import tap_logmeinrescue.streams
+from tap_logmeinrescue.report import ReportReader
+
+EXTRA_COLUMNS = 40
+
+
+def build_report(stream, rows):
+    columns = sorted(stream.load_schema_by_name(stream.TABLE)['properties'])
+    headers = [column.replace('_', ' ').title() for column in columns]
+    headers += ['Custom Field {}'.format(i) for i in range(EXTRA_COLUMNS)]
+
+    def value(header):
+        column = stream.convert_key(header)
+        schema = stream.load_schema_by_name(stream.TABLE)['properties'] \
+            .get(column, {})
+
+        if schema.get('format') == 'date-time':
+            return '2018-10-{:02d}T10:00:00Z'.format(random.randint(1, 28))
+
+        if 'integer' in schema.get('type', []):
+            return str(random.randint(1, 10 ** 6))
+
+        return random.choice(['', 'some text', 'a value, with a comma'])
+
+    values = [[value(header) for header in headers] for _ in range(10)]
+
+    yield '<report><header>'
+    yield ''.join('<field id="{}">{}</field>'.format(i, header)
+                  for i, header in enumerate(headers))
+    yield '</header><data>'
+
+    for row in range(rows):
+        yield '<row>' + ''.join(
+            '<field id="{}">{}</field>'.format(i, text)
+            for i, text in enumerate(values[row % len(values)])) + '</row>'
+
+    yield '</data></report>'
+
+
+def build_stream(stream_class):
+    stream = stream_class({}, {}, None, None)
+    headers = [stream.convert_key(header) for header in
+               ReportReader(build_report(stream, 0)).headers.values()]
+    stream.get_headers = lambda technician_id: headers
+    entry = stream.generate_catalog(None)[0]
+
+    # Deselect a column so that metadata filtering is part of the work.
+    for mdata in entry['metadata']:
+        if mdata['breadcrumb'] == ['properties', 'custom_field_0']:
+            mdata['metadata']['selected'] = False
+
+    stream.catalog = singer.catalog.CatalogEntry(
+        stream=entry['stream'],
+        schema=singer.schema.Schema.from_dict(entry['schema']),
+        metadata=entry['metadata'])
+
+    return stream
+
+
+def run(label, rows, transform):
+    started = time.perf_counter()
+    records = list(transform())
+    elapsed = time.perf_counter() - started
+
+    print('{:<10} {:>8} rows in {:6.2f}s  {:>10,.0f} rows/s'.format(
+        label, len(records), elapsed, rows / elapsed))
+
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--stream',
+                        default='transferred_sessions_extended_report')
+    args = parser.parse_args()
+
+    stream_class = next(
+        available for available in tap_logmeinrescue.streams.AVAILABLE_STREAMS
+        if available.TABLE == args.stream)
+    stream = build_stream(stream_class)
+    chunks = list(build_report(stream, args.rows))
+
+    # Parsing is the same for both paths, so it's left out of the timings.
+    reader = ReportReader(chunks)
+    rows = list(reader.rows())
+    values = list(ReportReader(chunks).values())
+
+    before = run('before', args.rows, lambda: (
+        stream.transform_record(row) for row in rows))
+
+    def compiled():
+        transformer = stream.get_row_transformer(reader.headers)
+
+        return (transformer(row) for row in values)
+
+    after = run('after', args.rows, compiled)
+
+    if before != after:
+        raise SystemExit('The two paths produced different records!')
+
+
+if __name__ == '__main__':
+    main()
@@ -16,11 +16,18 @@ setup(name='tap-logmeinrescue',
           'dev':[
               'ipython',
               'ipdb'
+          ],
+          'fast':[
+              'orjson'
+          ],
+          'parquet':[
+              'pyarrow'
           ]
       },
       entry_points='''
           [console_scripts]
           tap-logmeinrescue=tap_logmeinrescue:main
+          tap-logmeinrescue-merge-states=tap_logmeinrescue.sharding:main
       ''',
       packages=find_packages(),
       package_data={
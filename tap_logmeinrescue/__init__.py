@@ -1,13 +1,23 @@
+import cProfile
+import io
 import json
+import pstats
 import singer
 import sys
 import tap_framework
 import tap_framework.streams
 import tap_logmeinrescue.client
+import tap_logmeinrescue.output
+import tap_logmeinrescue.plan
+import tap_logmeinrescue.schema_cache
+import tap_logmeinrescue.sharding
+import tap_logmeinrescue.timing
 import tap_logmeinrescue.streams
 
 LOGGER = singer.get_logger()
 
+PROFILE_SUMMARY_LINES = 25
+
 
 class LogMeInRescueRunner(tap_framework.Runner):
 
@@ -33,13 +43,80 @@ class LogMeInRescueRunner(tap_framework.Runner):
 
         catalog += technicians_stream.generate_catalog()
 
-        technician_ids = technicians_stream.sync_data(return_ids=True)
+        # A live report, and so a technician to request it for, is only
+        # needed for the report streams whose headers aren't cached.
+        cache = tap_logmeinrescue.schema_cache.SchemaCache.from_config(
+            self.config)
+        technician_id = None
+
+        if any(cache.get(substream.get_schema_cache_key()) is None
+               for substream in technicians_substreams):
+            technician_ids = technicians_stream.sync_data(return_ids=True)
+            technician_id = technician_ids[0]
 
         for technicians_substream in technicians_substreams:
-            catalog += technicians_substream.generate_catalog(technician_ids[0])
+            catalog += technicians_substream.generate_catalog(technician_id)
 
         json.dump({'streams': catalog}, sys.stdout, indent=4)
 
+    def do_sync(self):
+        tap_logmeinrescue.output.configure(self.config)
+        tap_logmeinrescue.timing.reset()
+
+        profile_path = self.config.get('profile_path')
+        profiler = None
+
+        if profile_path:
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        try:
+            super().do_sync()
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self.save_profile(profiler, profile_path)
+
+        self.client.log_stats()
+        tap_logmeinrescue.output.log_stats()
+        tap_logmeinrescue.timing.log_summary()
+        tap_logmeinrescue.timing.save_history(
+            tap_logmeinrescue.timing.history_path(self.config))
+
+    def do_plan(self):
+        """Print what a sync would request from the current state, and how
+        long it should take, without requesting any report."""
+        LOGGER.info("Planning sync.")
+
+        history = tap_logmeinrescue.timing.load_history(
+            tap_logmeinrescue.timing.history_path(self.config))
+        plan = tap_logmeinrescue.plan.SyncPlan(
+            self.config, self.state, history)
+
+        for technicians_stream in self.get_streams_to_replicate():
+            technician_ids = technicians_stream.sync_data(return_ids=True)
+            shard = tap_logmeinrescue.sharding.Shard.from_config(self.config)
+
+            for substream in technicians_stream.substreams:
+                substream.hierarchy = technicians_stream.hierarchy
+                substream.shard = shard
+
+            plan.plan_streams(technicians_stream.substreams, technician_ids)
+
+        json.dump(plan.to_dict(), sys.stdout, indent=4)
+
+    def save_profile(self, profiler, path):
+        """Write the profile for `python -m pstats` and log its top
+        functions. Only the main thread is profiled."""
+        profiler.dump_stats(path)
+
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary) \
+            .sort_stats('cumulative') \
+            .print_stats(PROFILE_SUMMARY_LINES)
+
+        LOGGER.info('Profile written to %s:\n%s', path, summary.getvalue())
+
     def get_streams_to_replicate(self):
         streams = []
         technicians_stream = None
@@ -92,6 +169,8 @@ def main():
 
     if args.discover:
         runner.do_discover()
+    elif args.config.get('dry_run'):
+        runner.do_plan()
     else:
         runner.do_sync()
 
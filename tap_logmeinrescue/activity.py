@@ -0,0 +1,145 @@
+from datetime import timedelta
+
+from dateutil.parser import parse
+
+from tap_logmeinrescue.logger import LOGGER
+from tap_logmeinrescue.state import STATE_LOCK
+
+DEFAULT_DORMANT_AFTER_WINDOWS = 4
+DEFAULT_DORMANT_PROBE_DAYS = 28
+DEFAULT_FULL_SWEEP_DAYS = 30
+
+# Hierarchy statuses that tell us nothing about a technician's activity.
+INACTIVE_STATUSES = ('', 'offline')
+
+
+def format_date(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class ActivityIndex:
+    """Per technician record of how far their reports have been synced and
+    how many rows their recent windows returned, kept in the stream's
+    bookmarks as:
+
+        "activity": {
+            "<technician id>": {
+                "synced_through": "2018-10-08T00:00:00Z",
+                "last_active": "2018-09-03T00:00:00Z",
+                "rows": [0, 0, 0, 0]
+            }
+        }
+
+    Technicians whose last `dormant_after_windows` windows were all empty
+    are dormant. They're skipped until their unsynced span reaches
+    `dormant_probe_days` and are then fetched for that whole span in one
+    request, so nothing is missed, only fetched later."""
+
+    def __init__(self, bookmarks, config, hierarchy=None, enabled=True,
+                 now=None):
+        with STATE_LOCK:
+            self.entries = bookmarks.setdefault('activity', {})
+
+        self.bookmarks = bookmarks
+        self.hierarchy = hierarchy
+        self.enabled = enabled
+
+        self.dormant_after = int(config.get(
+            'dormant_after_windows', DEFAULT_DORMANT_AFTER_WINDOWS))
+        self.probe_span = timedelta(days=float(config.get(
+            'dormant_probe_days', DEFAULT_DORMANT_PROBE_DAYS)))
+
+        full_sweep_span = timedelta(days=float(config.get(
+            'activity_full_sweep_days', DEFAULT_FULL_SWEEP_DAYS)))
+        last_full_sweep = bookmarks.get('activity_full_sweep_at')
+
+        # The first run with the index counts as the start of the sweep
+        # period, skipping is what makes a long backfill cheaper.
+        if last_full_sweep is None and now is not None:
+            last_full_sweep = format_date(now)
+
+            with STATE_LOCK:
+                bookmarks['activity_full_sweep_at'] = last_full_sweep
+
+        self.full_sweep = last_full_sweep is None or \
+            now - parse(last_full_sweep) >= full_sweep_span
+        self.skipped = 0
+
+        if self.enabled and self.full_sweep:
+            LOGGER.info('Running a full sweep, no dormant technician '
+                        'will be skipped.')
+
+    @classmethod
+    def from_state(cls, state, table, config, hierarchy=None, now=None):
+        """Return the activity index for `table`, or None when it's neither
+        enabled nor present in the state."""
+        with STATE_LOCK:
+            bookmarks = state.setdefault('bookmarks', {}) \
+                             .setdefault(table, {})
+
+        enabled = bool(config.get('activity_index'))
+
+        # Technicians skipped by an earlier run still need to catch up, so
+        # an existing index is honoured even once it's been disabled.
+        if not enabled and not bookmarks.get('activity'):
+            return None
+
+        return cls(bookmarks, config, hierarchy, enabled=enabled, now=now)
+
+    def is_dormant(self, technician_id):
+        if self.hierarchy is not None:
+            status = (self.hierarchy.status(technician_id) or '').lower()
+
+            if status not in INACTIVE_STATUSES:
+                return False
+
+        rows = self.entries.get(str(technician_id), {}).get('rows', [])
+
+        return len(rows) >= self.dormant_after and \
+            not any(rows[-self.dormant_after:])
+
+    def plan(self, technician_ids, start_date, end_date):
+        """Return `(technician_id, start_date)` for each technician to
+        fetch in the window ending at `end_date`. A technician's start date
+        is where their reports were last synced through, when that's
+        earlier than the window's start."""
+        units = []
+
+        for technician_id in technician_ids:
+            entry = self.entries.get(str(technician_id), {})
+            unit_start = start_date
+
+            if entry.get('synced_through'):
+                unit_start = min(parse(entry['synced_through']), start_date)
+
+            if unit_start >= end_date:
+                continue
+
+            if self.enabled and not self.full_sweep and \
+               end_date - unit_start < self.probe_span and \
+               self.is_dormant(technician_id):
+                self.skipped += 1
+                continue
+
+            units.append((technician_id, unit_start))
+
+        return units
+
+    def record(self, technician_id, rows, end_date):
+        with STATE_LOCK:
+            entry = self.entries.setdefault(str(technician_id), {})
+            entry['synced_through'] = format_date(end_date)
+            entry['rows'] = \
+                (entry.get('rows', []) + [rows])[-self.dormant_after:]
+
+            if rows:
+                entry['last_active'] = format_date(end_date)
+
+    def finish(self, now):
+        if self.enabled and self.full_sweep:
+            with STATE_LOCK:
+                self.bookmarks['activity_full_sweep_at'] = format_date(now)
+
+        if self.skipped:
+            LOGGER.info('Skipped %s requests for dormant technicians.',
+                        self.skipped)
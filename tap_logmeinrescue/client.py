@@ -1,20 +1,184 @@
+import queue
+import threading
 import time
+from collections import Counter
+from contextlib import contextmanager
+
 import requests
 import singer
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
 from tap_framework.client import BaseClient
+from tap_logmeinrescue import timing
+from tap_logmeinrescue.ratelimit import RateLimiter, RetryBudget, \
+    backoff_delay, parse_retry_after
 
 
 LOGGER = singer.get_logger()
 
+DEFAULT_API_BASE_URL = 'https://secure.logmeinrescue.com/API'
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_RETRY_BASE_SECONDS = 15
+DEFAULT_RETRY_MAX_SECONDS = 120
+
+# Statuses the API answers with when the ASP.NET session has expired or
+# was never valid.
+SESSION_EXPIRED_STATUSES = ('NOTLOGGEDIN', 'NOT_LOGGED_IN', 'INVALIDSESSION')
+
+# How many times in a row a new session may expire, for one request or
+# while the report settings are applied to it again.
+MAX_RELOGIN_DEPTH = 3
+
+
+def split_status(chunks):
+    """Read a streamed API response up to the end of its status.
+
+    The API answers with a status followed by two newlines and the
+    payload. Returns the status text and the part of the payload that was
+    read along with it, leaving the rest of `chunks` unread."""
+    head = b''
+
+    for chunk in chunks:
+        head += chunk
+
+        if b'\n\n' in head:
+            break
+
+    status, _, rest = head.partition(b'\n\n')
+
+    return status.decode('utf-8'), rest
+
+
+def endpoint_name(url):
+    """Return the API endpoint of a URL, e.g. 'getReport_v2'."""
+    return url.rsplit('/', 1)[-1].split('.')[0]
+
+
+def is_session_expired(text):
+    """Whether an API response says the session is no longer valid."""
+    status = text.split('\n\n', 1)[0].strip().upper()
+
+    return status in SESSION_EXPIRED_STATUSES
+
+
+class ClientStats:
+    """Thread-safe counters describing the work done by a client."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = Counter()
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def get(self, name):
+        with self.lock:
+            return self.counters[name]
+
+    def as_dict(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+def counting_pool_class(base, stats):
+    """Return a subclass of the urllib3 pool `base` which records every new
+    connection it opens in `stats`."""
+
+    class CountingConnectionPool(base):
+
+        def _new_conn(self):
+            stats.increment('connections_opened')
+            return super()._new_conn()
+
+    return CountingConnectionPool
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """An HTTPAdapter that keeps a pool of keep-alive connections per host
+    and counts how many of them it had to open."""
+
+    def __init__(self, stats, pool_size=DEFAULT_POOL_SIZE):
+        self.stats = stats
+
+        super().__init__(pool_connections=pool_size,
+                         pool_maxsize=pool_size,
+                         max_retries=0)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': counting_pool_class(HTTPConnectionPool, self.stats),
+            'https': counting_pool_class(HTTPSConnectionPool, self.stats),
+        }
+
 
 class LogMeInRescueClient(BaseClient):
 
-    def __init__(self, config):
+    def __init__(self, config, stats=None, rate_limiter=None,
+                 retry_budget=None):
         super().__init__(config)
 
+        self.api_base_url = self.config.get(
+            'api_base_url', DEFAULT_API_BASE_URL).rstrip('/')
         self.cookie = None
+        self.logged_in_at = None
+        self.report_area = None
+        self.report_area_url = None
+        self.report_settings = {}
+        # Whether the settings are taken to carry over from one report area
+        # to the next, see `set_report_setting`.
+        self.share_report_settings = False
+        self.relogin_depth = 0
         self.user_agent = self.config.get('user_agent')
+        self.stats = stats if stats is not None else ClientStats()
+        self.session = self.create_session()
+
+        if rate_limiter is None:
+            rate_limiter = RateLimiter.from_config(self.config)
+
+        if retry_budget is None:
+            retry_budget = RetryBudget(self.config.get('retry_budget'))
+
+        self.rate_limiter = rate_limiter
+        self.retry_budget = retry_budget
+        self.max_retries = int(
+            self.config.get('max_retries', DEFAULT_MAX_RETRIES))
+        self.retry_max_seconds = float(
+            self.config.get('retry_max_seconds', DEFAULT_RETRY_MAX_SECONDS))
+
+    def spawn(self):
+        """Return a new client for the same account with its own API
+        session. Report settings live on the API session, so each thread
+        issuing report calls needs a client of its own. The rate limiter
+        and retry budget are shared."""
+        return self.__class__(self.config, stats=self.stats,
+                              rate_limiter=self.rate_limiter,
+                              retry_budget=self.retry_budget)
+
+    def close(self):
+        self.session.close()
+
+    def get_url(self, endpoint):
+        return '{}/{}.aspx'.format(self.api_base_url, endpoint)
+
+    def create_session(self):
+        pool_size = int(self.config.get('pool_size', DEFAULT_POOL_SIZE))
+        adapter = PooledHTTPAdapter(self.stats, pool_size=pool_size)
+
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        })
+
+        return session
 
     def get_headers(self):
         if self.user_agent:
@@ -24,66 +188,362 @@ class LogMeInRescueClient(BaseClient):
 
         return {}
 
-    def make_request(self, url, method, base_backoff=15,
-                     params=None):
-        self.login()
-        backoff = False
+    def send(self, method, url, params=None, stream=False):
+        self.stats.increment('requests')
 
-        LOGGER.info("Making {} request to {}".format(method, url))
+        return self.session.request(
+            method,
+            url,
+            headers=self.get_headers(),
+            params=params,
+            stream=stream)
 
-        with singer.metrics.Timer('request_duration', {}) as timer:
-            response = requests.request(
-                method,
-                url,
-                headers=self.get_headers(),
-                cookies={
-                    'ASP.NET_SessionId': self.cookie
-                },
-                params=params)
+    def make_request(self, url, method, base_backoff=None,
+                     params=None, stream=False):
+        """Return the response body as text or, with `stream`, the
+        response itself with its body left unread.
 
-            if response.status_code == 429:
-                if base_backoff > 120:
-                    raise RuntimeError('Backed off too many times, exiting!')
+        A response saying the API session has expired is retried after
+        logging in again, up to `MAX_RELOGIN_DEPTH` times. Streamed
+        responses are checked by `stream_request` instead, as that means
+        reading their body."""
+        self.refresh_session_if_due()
+        self.login()
 
-                backoff = True
-                timer.status = 'failed'
+        response = self.request_with_retries(
+            method, url, params=params, stream=stream,
+            base_backoff=base_backoff)
 
-            if response.status_code != 200:
-                raise RuntimeError(response.text)
+        if stream:
+            return response
 
-        if backoff:
-            LOGGER.warn('Got a 429, sleeping for {} seconds and trying again'
-                        .format(base_backoff))
+        expired = 0
 
-            time.sleep(base_backoff)
+        while is_session_expired(response.text):
+            expired += 1
+            self.relogin_after_expiry(expired)
 
-            return self.make_request(url, method, base_backoff * 2, params)
+            response = self.request_with_retries(
+                method, url, params=params, base_backoff=base_backoff)
 
         return response.text
 
+    def relogin_after_expiry(self, expired):
+        """Log in again after a request found the session expired, which
+        it has `expired` times in a row. A session that keeps expiring is
+        an error of its own, not a report that failed."""
+        if expired > MAX_RELOGIN_DEPTH:
+            raise RuntimeError(
+                'The API session expired {} times in a row, exiting!'
+                .format(expired))
+
+        self.relogin('the session expired')
+
+    def request_with_retries(self, method, url, params=None, stream=False,
+                             base_backoff=None):
+        """Send a request through the shared rate limiter, retrying 429s,
+        5xx responses and connection errors with jittered exponential
+        backoff until `max_retries` or the run's `retry_budget` runs out."""
+        if base_backoff is None:
+            base_backoff = float(self.config.get(
+                'retry_base_seconds', DEFAULT_RETRY_BASE_SECONDS))
+
+        attempt = 0
+        endpoint = endpoint_name(url)
+
+        while True:
+            throttled = self.rate_limiter.acquire()
+
+            if throttled:
+                self.stats.increment('throttled_seconds', throttled)
+                timing.record('throttle', throttled, endpoint=endpoint)
+
+            LOGGER.info("Making {} request to {}".format(method, url))
+
+            retry_after = None
+
+            with singer.metrics.Timer('request_duration', {}) as timer:
+                try:
+                    with timing.timed('request', endpoint=endpoint):
+                        response = self.send(
+                            method, url, params=params, stream=stream)
+
+                except (requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout) as e:
+                    timer.status = 'failed'
+                    reason = 'connection_error'
+                    error = str(e)
+
+                else:
+                    if response.status_code == 200:
+                        return response
+
+                    timer.status = 'failed'
+                    error = response.text
+
+                    if response.status_code == 429:
+                        reason = '429'
+                        retry_after = parse_retry_after(
+                            response.headers.get('Retry-After'))
+                    elif response.status_code >= 500:
+                        reason = '5xx'
+                    else:
+                        raise RuntimeError(error)
+
+                    response.close()
+
+            attempt += 1
+
+            if attempt > self.max_retries:
+                raise RuntimeError(
+                    'Backed off too many times, exiting! Last error: {}'
+                    .format(error))
+
+            if not self.retry_budget.take():
+                raise RuntimeError(
+                    'Retry budget exhausted, exiting! Last error: {}'
+                    .format(error))
+
+            delay = backoff_delay(
+                attempt, base_backoff, self.retry_max_seconds)
+
+            if retry_after is not None:
+                delay = retry_after
+
+            if reason == '429':
+                # Hold every session back, not just this one.
+                self.rate_limiter.pause(delay)
+
+            self.stats.increment('retries_{}'.format(reason))
+            self.stats.increment('backoff_seconds', delay)
+
+            LOGGER.warning(
+                'Got a %s, sleeping for %.1f seconds and trying again '
+                '(attempt %s of %s)', reason.replace('_', ' '), delay,
+                attempt, self.max_retries)
+
+            with timing.timed('backoff', endpoint=endpoint):
+                time.sleep(delay)
+
+    def stream_request(self, url, method, params=None):
+        """Make a request and return its status and an iterator over the
+        rest of the body, read from the connection as it's consumed.
+
+        The connection is released once the iterator is exhausted or
+        discarded, or straight away if the status isn't OK."""
+        chunk_size = int(
+            self.config.get('response_chunk_size', DEFAULT_CHUNK_SIZE))
+
+        endpoint = endpoint_name(url)
+
+        response = self.make_request(url, method, params=params, stream=True)
+        chunks = timing.timed_iter(
+            response.iter_content(chunk_size), 'download', endpoint=endpoint)
+        status, head = split_status(chunks)
+        expired = 0
+
+        while is_session_expired(status):
+            response.close()
+            expired += 1
+            self.relogin_after_expiry(expired)
+
+            response = self.request_with_retries(
+                method, url, params=params, stream=True)
+            chunks = timing.timed_iter(response.iter_content(chunk_size),
+                                       'download', endpoint=endpoint)
+            status, head = split_status(chunks)
+
+        if status != 'OK':
+            response.close()
+            return status, iter(())
+
+        def iter_body():
+            try:
+                yield head
+                yield from chunks
+            finally:
+                response.close()
+
+        return status, iter_body()
+
     def login(self):
         if self.cookie is not None:
             return
 
-        url = 'https://secure.logmeinrescue.com/API/login.aspx'
+        url = self.get_url('login')
 
         params = {
             'email': self.config.get('username'),
             'pwd': self.config.get('password')
         }
 
-        LOGGER.info("Making GET request to {}".format(url))
-
-        response = requests.get(
-            url,
-            headers=self.get_headers(),
-            params=params
-        )
+        response = self.request_with_retries('GET', url, params=params)
 
+        # The session cookie is kept on self.session and sent with every
+        # subsequent request, we only hold on to its value to know that
+        # we're logged in.
         if 'OK' in response.text:
-            self.cookie = response.cookies.get('ASP.NET_SessionId')
+            self.cookie = self.session.cookies.get('ASP.NET_SessionId')
 
         if self.cookie is None or 'INVALID' in response.text:
             raise RuntimeError(
                 'Failed to login! Please double check '
                 'the provided credentials and try again.')
+
+        self.logged_in_at = time.monotonic()
+        self.stats.increment('logins')
+
+        # Report settings are stored server side against the ASP.NET
+        # session, a new session starts out with none of them applied.
+        self.report_area = None
+        self.report_settings = {}
+
+    def relogin(self, reason):
+        """Start a new API session and apply the active report area and
+        its settings to it again, so that the next report call behaves as
+        it would have on the old session."""
+        if self.relogin_depth >= MAX_RELOGIN_DEPTH:
+            raise RuntimeError(
+                'The API session expired {} times in a row while the report '
+                'settings were applied to a new one, exiting!'
+                .format(self.relogin_depth))
+
+        LOGGER.warning('Logging in again because %s.', reason)
+
+        report_area = self.report_area
+        report_settings = dict(self.get_applied_settings())
+
+        self.cookie = None
+        self.session.cookies.clear()
+        self.relogin_depth += 1
+
+        try:
+            self.login()
+            self.stats.increment('relogins')
+
+            if report_area is None:
+                return
+
+            self.set_report_area(self.report_area_url, report_area)
+
+            for url, params in report_settings.items():
+                self.set_report_setting(url, params)
+
+        finally:
+            self.relogin_depth -= 1
+
+    def refresh_session_if_due(self):
+        refresh_seconds = self.config.get('session_refresh_seconds')
+
+        if refresh_seconds is None or self.cookie is None:
+            return
+
+        if time.monotonic() - self.logged_in_at >= float(refresh_seconds):
+            self.relogin('the session is due for a refresh')
+
+    def send_report_setting(self, url, params):
+        resp = self.make_request(url, 'POST', params=params)
+        status = resp.split("\n\n", 1)[0]
+
+        if status != "OK":
+            name = url.rsplit('/', 1)[-1].split('.', 1)[0]
+            raise Exception("Error with {} request: {}".format(name, status))
+
+        self.stats.increment('report_settings_sent')
+
+    def set_report_area(self, url, area):
+        """Select the report area used by subsequent report calls, unless
+        it is already the active one for this session."""
+        self.login()
+
+        if self.report_area == area:
+            self.stats.increment('report_settings_skipped')
+            return
+
+        self.send_report_setting(url, {'area': area})
+
+        # Sending may have replaced the session, and applied the previous
+        # area to the new one, before the request was retried on it.
+        self.report_area = area
+        self.report_area_url = url
+
+    def get_applied_settings(self):
+        """Return the settings applied on this session to the active report
+        area, or to every area when they're shared."""
+        area = None if self.share_report_settings else self.report_area
+
+        return self.report_settings.setdefault(area, {})
+
+    def set_report_setting(self, url, params):
+        """Apply a report setting (timezone, dates, output...) to the
+        active report area, unless that exact value was the last one sent
+        for it on this session.
+
+        Settings are tracked per report area, so switching to an area
+        sends its settings again the first time they're needed there. With
+        `share_report_settings`, as the combined sweep sets, they're
+        tracked per session and only sent again when they change."""
+        self.login()
+
+        if self.get_applied_settings().get(url) == params:
+            self.stats.increment('report_settings_skipped')
+            return
+
+        self.send_report_setting(url, params)
+
+        # Sending may have replaced the session, and with it the map of
+        # applied settings, so it's looked up again.
+        self.get_applied_settings()[url] = params
+
+    def log_stats(self):
+        stats = self.stats.as_dict()
+        requests_made = stats.get('requests', 0)
+        opened = stats.get('connections_opened', 0)
+
+        LOGGER.info(
+            'HTTP transport: %s requests, %s connections opened, '
+            '%s connections reused',
+            requests_made, opened, max(requests_made - opened, 0))
+        LOGGER.info(
+            'Report settings: %s calls sent, %s calls skipped',
+            stats.get('report_settings_sent', 0),
+            stats.get('report_settings_skipped', 0))
+        LOGGER.info(
+            'Rate limiting: %.1f seconds throttled, %.1f seconds backing '
+            'off, retries: %s 429, %s 5xx, %s connection errors',
+            stats.get('throttled_seconds', 0),
+            stats.get('backoff_seconds', 0),
+            stats.get('retries_429', 0),
+            stats.get('retries_5xx', 0),
+            stats.get('retries_connection_error', 0))
+        LOGGER.info(
+            'API sessions: %s logins, %s of them to replace an expired or '
+            'stale session',
+            stats.get('logins', 0),
+            stats.get('relogins', 0))
+
+
+class ClientPool:
+    """A fixed set of independent clients that worker threads check out
+    one at a time."""
+
+    def __init__(self, client, size):
+        self.spawned = [client.spawn() for _ in range(size - 1)]
+        self.clients = queue.Queue()
+
+        for pooled in [client] + self.spawned:
+            self.clients.put(pooled)
+
+    @contextmanager
+    def checkout(self):
+        client = self.clients.get()
+
+        try:
+            yield client
+        finally:
+            self.clients.put(client)
+
+    def close(self):
+        # The client the pool was built from belongs to the caller.
+        for client in self.spawned:
+            client.close()
@@ -0,0 +1,311 @@
+import array
+import base64
+import bisect
+import collections
+import gzip
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from dateutil.parser import parse
+
+from tap_logmeinrescue.logger import LOGGER
+from tap_logmeinrescue.snapshot import fingerprint
+from tap_logmeinrescue.state import get_last_record_value_for_table
+
+DEFAULT_MAX_ROWS = 1000000
+DEFAULT_TTL_HOURS = 24 * 30
+
+
+def row_fingerprint(record):
+    """Return a 64 bit hash of `record`, as a signed integer that fits an
+    array of type 'q'."""
+    encoded = json.dumps(record, sort_keys=True, default=str)
+    digest = hashlib.blake2b(encoded.encode('utf-8'), digest_size=8).digest()
+
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+def to_epoch(value):
+    return int(value.timestamp())
+
+
+def pack(values):
+    # Saved little endian, whatever the machine.
+    if sys.byteorder == 'big':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+
+def unpack(typecode, encoded):
+    values = array.array(typecode)
+    values.frombytes(base64.b64decode(encoded))
+
+    if sys.byteorder == 'big':
+        values.byteswap()
+
+    return values
+
+
+class StreamIndex:
+    """The fingerprints of a stream in sorted arrays, with the window end
+    and the last time each was seen alongside, 16 bytes per row. New
+    fingerprints are kept in a dict until `MERGE_ROWS` of them are merged
+    into the arrays at once."""
+
+    MERGE_ROWS = 65536
+
+    def __init__(self):
+        self.fingerprints = array.array('q')
+        self.window_ends = array.array('I')
+        self.seen = array.array('I')
+        # fingerprint -> [window end, last seen]
+        self.recent = {}
+        self.checked = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.fingerprints) + len(self.recent)
+
+    def touch(self, fingerprint, now):
+        """Mark `fingerprint` as seen at `now`, returning whether it was
+        already in the index."""
+        entry = self.recent.get(fingerprint)
+
+        if entry is not None:
+            entry[1] = now
+            return True
+
+        index = bisect.bisect_left(self.fingerprints, fingerprint)
+
+        if index < len(self.fingerprints) and \
+           self.fingerprints[index] == fingerprint:
+            self.seen[index] = now
+            return True
+
+        return False
+
+    def add(self, fingerprint, window_end, now):
+        self.recent[fingerprint] = [window_end, now]
+
+        if len(self.recent) >= self.MERGE_ROWS:
+            self.merge()
+
+    def merge(self):
+        if not self.recent:
+            return
+
+        fingerprints = array.array('q')
+        window_ends = array.array('I')
+        seen = array.array('I')
+        previous = 0
+
+        for fingerprint in sorted(self.recent):
+            index = bisect.bisect_left(
+                self.fingerprints, fingerprint, previous)
+            fingerprints.extend(self.fingerprints[previous:index])
+            window_ends.extend(self.window_ends[previous:index])
+            seen.extend(self.seen[previous:index])
+
+            window_end, seen_at = self.recent[fingerprint]
+            fingerprints.append(fingerprint)
+            window_ends.append(window_end)
+            seen.append(seen_at)
+            previous = index
+
+        fingerprints.extend(self.fingerprints[previous:])
+        window_ends.extend(self.window_ends[previous:])
+        seen.extend(self.seen[previous:])
+
+        self.fingerprints = fingerprints
+        self.window_ends = window_ends
+        self.seen = seen
+        self.recent = {}
+
+    def keep(self, mask):
+        """Keep the rows whose entry in `mask` is set."""
+        self.fingerprints = array.array(
+            'q', itertools.compress(self.fingerprints, mask))
+        self.window_ends = array.array(
+            'I', itertools.compress(self.window_ends, mask))
+        self.seen = array.array('I', itertools.compress(self.seen, mask))
+
+    def evict(self, max_rows):
+        """Forget the rows seen least recently, down to `max_rows`."""
+        self.merge()
+        excess = len(self.fingerprints) - max_rows
+
+        if excess <= 0:
+            return
+
+        oldest = heapq.nsmallest(excess, self.seen)
+        cutoff = oldest[-1]
+        # Rows last seen at the cutoff are only partly evicted.
+        ties = oldest.count(cutoff)
+        mask = bytearray(len(self.seen))
+
+        for index, seen_at in enumerate(self.seen):
+            if seen_at < cutoff:
+                continue
+
+            if seen_at == cutoff and ties:
+                ties -= 1
+                continue
+
+            mask[index] = 1
+
+        self.keep(mask)
+
+
+class DedupIndex:
+    """Fingerprints of the report rows already emitted, kept per stream in
+    a local file so that rows emitted again, by windows that overlap or
+    that are synced again, can be dropped before they're written.
+
+    Each fingerprint is kept with the end of the window its row was
+    emitted in. When the index is loaded, rows from windows past the
+    stream's `start_date` bookmark are forgotten: the target may not have
+    loaded them, so they're emitted again. Rows not seen for `ttl_hours`
+    are forgotten, and past `max_rows` per stream the rows seen least
+    recently are, a tenth of `max_rows` at a time.
+
+    A row takes 16 bytes of memory, about 15 MiB per million rows and
+    stream."""
+
+    def __init__(self, path, max_rows=DEFAULT_MAX_ROWS,
+                 ttl_hours=DEFAULT_TTL_HOURS):
+        self.path = path
+        self.max_rows = max(int(max_rows), 1)
+        self.ttl_seconds = float(ttl_hours) * 3600
+        self.streams = collections.defaultdict(StreamIndex)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, shard=None):
+        """Return the index when `dedup_index` is set, or None."""
+        if not config.get('dedup_index'):
+            return None
+
+        path = config.get('dedup_index_path')
+
+        if path is None:
+            name = config.get('username')
+
+            if shard is not None:
+                name = [name, shard.name]
+
+            path = os.path.join(
+                tempfile.gettempdir(),
+                'tap-logmeinrescue-dedup-{}.json.gz'.format(
+                    fingerprint(name)))
+
+        return cls(path,
+                   config.get('dedup_max_rows', DEFAULT_MAX_ROWS),
+                   config.get('dedup_ttl_hours', DEFAULT_TTL_HOURS))
+
+    def load(self, state, now=None):
+        """Read the index, keeping only the rows the state says were
+        synced and that haven't expired."""
+        now = time.time() if now is None else now
+
+        try:
+            with gzip.open(self.path, 'rt') as handle:
+                saved = json.load(handle)
+        except (IOError, OSError, ValueError):
+            return self
+
+        kept = 0
+
+        for key, saved_stream in saved.get('streams', {}).items():
+            synced_through = get_last_record_value_for_table(
+                state, key, 'start_date')
+
+            if synced_through is None:
+                continue
+
+            synced_through = to_epoch(parse(synced_through))
+            stream = self.streams[key]
+            stream.fingerprints = unpack('q', saved_stream['fingerprints'])
+            stream.window_ends = unpack('I', saved_stream['window_ends'])
+            stream.seen = unpack('I', saved_stream['seen'])
+
+            stream.keep(bytearray(
+                window_end <= synced_through and
+                now - seen_at < self.ttl_seconds
+                for window_end, seen_at in zip(stream.window_ends,
+                                               stream.seen)))
+            stream.evict(self.max_rows)
+
+            kept += len(stream)
+
+        LOGGER.info('Loaded %s row fingerprints from %s.', kept, self.path)
+
+        return self
+
+    def is_new(self, key, record, window_end):
+        """Whether `record` wasn't emitted before for the stream whose
+        bookmarks are under `key`. New rows are added to the index."""
+        fingerprint = row_fingerprint(record)
+        now = int(time.time())
+
+        with self.lock:
+            stream = self.streams[key]
+            stream.checked += 1
+
+            if stream.touch(fingerprint, now):
+                stream.dropped += 1
+                return False
+
+            stream.add(fingerprint, to_epoch(window_end), now)
+
+            if len(stream) > self.max_rows:
+                stream.evict(self.max_rows - self.max_rows // 10)
+
+            return True
+
+    def save(self):
+        with self.lock:
+            saved = {'streams': {}}
+
+            for key, stream in self.streams.items():
+                stream.merge()
+                saved['streams'][key] = {
+                    'fingerprints': pack(stream.fingerprints),
+                    'window_ends': pack(stream.window_ends),
+                    'seen': pack(stream.seen),
+                }
+
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+
+            with tempfile.NamedTemporaryFile(
+                    dir=directory, delete=False) as handle:
+                with gzip.GzipFile(fileobj=handle, mode='wb') as compressed:
+                    compressed.write(json.dumps(saved).encode('utf-8'))
+
+            os.replace(handle.name, self.path)
+
+        except (IOError, OSError) as e:
+            LOGGER.warning('Could not write the dedup index to %s: %s',
+                           self.path, e)
+
+    def log_stats(self):
+        with self.lock:
+            for key, stream in sorted(self.streams.items()):
+                if not stream.checked:
+                    continue
+
+                LOGGER.info(
+                    'Dedup %s: %s of %s rows dropped (%.1f%%), %s '
+                    'fingerprints kept.', key, stream.dropped,
+                    stream.checked, 100.0 * stream.dropped / stream.checked,
+                    len(stream))
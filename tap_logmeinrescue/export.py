@@ -0,0 +1,273 @@
+import gzip
+import os
+import pathlib
+import uuid
+
+from tap_logmeinrescue.logger import LOGGER
+
+EXPORT_FORMATS = ('jsonl', 'parquet')
+DEFAULT_PART_ROWS = 1000000
+DEFAULT_BATCH_ROWS = 10000
+DATE_FORMAT = '%Y%m%dT%H%M%SZ'
+
+
+def get_parquet():
+    """Return pyarrow and its parquet module, an optional dependency,
+    install `tap-logmeinrescue[parquet]` to get it."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError('The parquet export_format needs pyarrow, '
+                           'install tap-logmeinrescue[parquet].')
+
+    return pyarrow, pyarrow.parquet
+
+
+def arrow_type(pyarrow, schema):
+    types = schema.get('type')
+
+    if not isinstance(types, list):
+        types = [types]
+
+    if schema.get('format') == 'date-time':
+        # Kept as the ISO 8601 strings the records hold.
+        return pyarrow.string()
+
+    if 'integer' in types:
+        return pyarrow.int64()
+
+    if 'number' in types:
+        return pyarrow.float64()
+
+    if 'boolean' in types:
+        return pyarrow.bool_()
+
+    return pyarrow.string()
+
+
+class JsonLinesPart:
+    """A gzipped file of one JSON record per line."""
+
+    ENCODING = {'format': 'jsonl', 'compression': 'gzip'}
+    SUFFIX = '.jsonl.gz'
+
+    def __init__(self, path, columns, properties, encode, batch_rows):
+        self.handle = gzip.open(path, 'wt', encoding='utf-8')
+        self.encode = encode
+        self.batch_rows = batch_rows
+        self.pending = []
+
+    def write(self, records):
+        self.pending.extend(self.encode(record) for record in records)
+
+        if len(self.pending) >= self.batch_rows:
+            self.write_pending()
+
+    def write_pending(self):
+        if self.pending:
+            self.pending.append('')
+            self.handle.write('\n'.join(self.pending))
+            self.pending = []
+
+    def close(self):
+        self.write_pending()
+        self.handle.close()
+
+
+class ParquetPart:
+    """A parquet file with a column for each report header in the schema,
+    written a row group of `batch_rows` at a time."""
+
+    ENCODING = {'format': 'parquet', 'compression': 'gzip'}
+    SUFFIX = '.parquet'
+
+    def __init__(self, path, columns, properties, encode, batch_rows):
+        self.pyarrow, parquet = get_parquet()
+        self.columns = columns
+        self.schema = self.pyarrow.schema([
+            (column, arrow_type(self.pyarrow, properties[column]))
+            for column in columns])
+        self.writer = parquet.ParquetWriter(path, self.schema,
+                                            compression='gzip')
+        self.batch_rows = batch_rows
+        self.pending = []
+
+    def write(self, records):
+        self.pending.extend(records)
+
+        if len(self.pending) >= self.batch_rows:
+            self.write_pending()
+
+    def write_pending(self):
+        if self.pending:
+            self.writer.write_table(self.pyarrow.Table.from_pydict(
+                {column: [record.get(column) for record in self.pending]
+                 for column in self.columns},
+                schema=self.schema))
+            self.pending = []
+
+    def close(self):
+        self.write_pending()
+        self.writer.close()
+
+
+PART_FORMATS = {
+    'jsonl': JsonLinesPart,
+    'parquet': ParquetPart,
+}
+
+
+class OpenPart:
+
+    def __init__(self, part, path, window):
+        self.part = part
+        self.path = path
+        self.window = window
+        self.rows = 0
+
+
+class Exporter:
+    """Writes the rows of report streams to local files instead of RECORD
+    messages, for loaders that ingest files in bulk.
+
+    Files are partitioned by stream and date window, as
+    `<directory>/<stream>/<start>-<end>/part-<run>-<n>.jsonl.gz`. A file is
+    finished when its window ends, once it holds `part_rows` rows and
+    whenever the state is written, so a STATE message never covers rows
+    that aren't in a finished file. Each finished file is announced with a
+    BATCH message holding its URL. Files are written under a temporary
+    name until they're finished."""
+
+    def __init__(self, directory, export_format='jsonl', encode=None,
+                 part_rows=DEFAULT_PART_ROWS, batch_rows=DEFAULT_BATCH_ROWS):
+        if export_format not in PART_FORMATS:
+            raise Exception(
+                "Unknown export_format '{}', expected one of: {}"
+                .format(export_format, ', '.join(EXPORT_FORMATS)))
+
+        if export_format == 'parquet':
+            get_parquet()
+
+        self.directory = directory
+        self.part_class = PART_FORMATS[export_format]
+        self.encode = encode
+        self.part_rows = max(int(part_rows), 1)
+        self.batch_rows = max(int(batch_rows), 1)
+
+        # Part files from concurrent runs, e.g. shards, never collide.
+        self.run_id = uuid.uuid4().hex[:8]
+        self.parts_started = 0
+        self.files_written = 0
+        self.rows_written = 0
+
+        self.properties = {}
+        self.windows = {}
+        self.columns = {}
+        self.open_parts = {}
+
+    @classmethod
+    def from_config(cls, config, encode):
+        """Return the exporter configured by `export_dir`, or None."""
+        directory = config.get('export_dir')
+
+        if not directory:
+            return None
+
+        return cls(directory,
+                   config.get('export_format', 'jsonl'),
+                   encode,
+                   config.get('export_part_rows', DEFAULT_PART_ROWS),
+                   config.get('export_batch_rows', DEFAULT_BATCH_ROWS))
+
+    def set_schema(self, stream, schema):
+        self.properties[stream] = schema.get('properties', {})
+
+    def exports(self, stream):
+        return stream in self.windows
+
+    def start_report(self, stream, start_date, end_date, headers):
+        """Route the rows of `stream` that follow to the files of the window
+        from `start_date` to `end_date`. `headers` are the report's
+        converted headers, the file's columns are the ones in the schema.
+        Returns the BATCH messages of the files this finishes."""
+        window = (start_date.strftime(DATE_FORMAT),
+                  end_date.strftime(DATE_FORMAT))
+        self.windows[stream] = window
+
+        if headers and stream not in self.columns:
+            properties = self.properties.get(stream, {})
+            self.columns[stream] = [header for header in headers
+                                    if header in properties]
+
+        open_part = self.open_parts.get(stream)
+
+        if open_part is not None and open_part.window != window:
+            return [self.finish_part(stream)]
+
+        return []
+
+    def write(self, stream, records):
+        """Write `records` to the stream's current file, returning the BATCH
+        messages of the files this finishes."""
+        messages = []
+        offset = 0
+
+        while offset < len(records):
+            open_part = self.open_parts.get(stream)
+
+            if open_part is None:
+                open_part = self.start_part(stream)
+
+            batch = records[offset:offset + self.part_rows - open_part.rows]
+            open_part.part.write(batch)
+            open_part.rows += len(batch)
+            offset += len(batch)
+
+            if open_part.rows >= self.part_rows:
+                messages.append(self.finish_part(stream))
+
+        return messages
+
+    def start_part(self, stream):
+        start, end = self.windows[stream]
+        directory = os.path.join(self.directory, stream,
+                                 '{}-{}'.format(start, end))
+        os.makedirs(directory, exist_ok=True)
+
+        self.parts_started += 1
+        path = os.path.join(directory, 'part-{}-{:05d}{}'.format(
+            self.run_id, self.parts_started, self.part_class.SUFFIX))
+
+        part = self.part_class(
+            path + '.tmp', self.columns.get(stream, []),
+            self.properties.get(stream, {}), self.encode, self.batch_rows)
+        open_part = OpenPart(part, path, (start, end))
+        self.open_parts[stream] = open_part
+
+        return open_part
+
+    def finish_part(self, stream):
+        open_part = self.open_parts.pop(stream)
+        open_part.part.close()
+        os.replace(open_part.path + '.tmp', open_part.path)
+
+        self.files_written += 1
+        self.rows_written += open_part.rows
+
+        return {
+            'type': 'BATCH',
+            'stream': stream,
+            'encoding': dict(self.part_class.ENCODING),
+            'manifest': [pathlib.Path(
+                os.path.abspath(open_part.path)).as_uri()],
+        }
+
+    def finish(self):
+        """Finish every open file, returning their BATCH messages."""
+        return [self.finish_part(stream)
+                for stream in sorted(self.open_parts)]
+
+    def log_stats(self):
+        LOGGER.info('Export: %s rows in %s files under %s.',
+                    self.rows_written, self.files_written, self.directory)
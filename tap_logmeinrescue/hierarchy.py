@@ -0,0 +1,195 @@
+import codecs
+from collections import defaultdict
+
+from tap_logmeinrescue.logger import LOGGER
+
+TECHNICIAN = 'Technician'
+
+
+def to_node_id(value):
+    """Return `value` as a node id, or None when it isn't one."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def iter_lines(chunks):
+    """Yield the lines of a document given as an iterable of str or UTF-8
+    bytes pieces, without the newlines."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    pending = ''
+
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+
+        yield from lines
+
+    pending += decoder.decode(b'', final=True)
+
+    if pending:
+        yield pending
+
+
+def parse_nodes(lines):
+    """Yield each node of a getHierarchy_v2 payload as a dict of field name
+    to value.
+
+    Nodes are separated by blank lines and each field is a `Name:value`
+    line. Only the first colon separates the two, values may hold more.
+    A line without any colon continues the previous field's value."""
+    node = {}
+    last_key = None
+
+    for line in lines:
+        line = line.rstrip('\r')
+
+        if not line:
+            if node:
+                yield node
+
+            node = {}
+            last_key = None
+            continue
+
+        key, separator, value = line.partition(':')
+
+        if separator:
+            node[key] = value
+            last_key = key
+        elif last_key is not None:
+            node[last_key] += '\n' + line
+
+    if node:
+        yield node
+
+
+class Hierarchy:
+    """The company tree returned by getHierarchy_v2: groups, administrators
+    and the technicians below them."""
+
+    def __init__(self):
+        self.nodes = {}
+        self.children = defaultdict(list)
+        self.subtree_technicians = None
+
+    def add(self, node):
+        """Add a node, returning whether it could be. A node without a
+        usable id is logged and left out."""
+        node_id = to_node_id(node.get('nodeid'))
+
+        if node_id is None:
+            LOGGER.warning('Skipping a hierarchy node without a usable '
+                           'nodeid: %s', node)
+            return False
+
+        parent_id = to_node_id(node.get('parentid')) or 0
+
+        self.nodes[node_id] = {
+            'type': node.get('type'),
+            'parentid': parent_id,
+            'status': node.get('status'),
+        }
+        self.children[parent_id].append(node_id)
+        self.subtree_technicians = None
+
+        return True
+
+    def is_technician(self, node_id):
+        return self.nodes.get(node_id, {}).get('type') == TECHNICIAN
+
+    def status(self, node_id):
+        return self.nodes.get(node_id, {}).get('status')
+
+    def is_group(self, node_id):
+        node_type = self.nodes.get(node_id, {}).get('type') or ''
+        return node_type.endswith('Group')
+
+    def roots(self):
+        return sorted(node_id for node_id, node in self.nodes.items()
+                      if node['parentid'] not in self.nodes)
+
+    def technicians_under(self, node_id):
+        """Return the set of technician ids anywhere below `node_id`,
+        including `node_id` itself if it's a technician."""
+        if self.subtree_technicians is None:
+            self.subtree_technicians = self.build_subtree_technicians()
+
+        return self.subtree_technicians.get(node_id, frozenset())
+
+    def build_subtree_technicians(self):
+        subtrees = {}
+        stack = [(node_id, False) for node_id in self.roots()]
+
+        while stack:
+            node_id, expanded = stack.pop()
+
+            if not expanded:
+                stack.append((node_id, True))
+                stack.extend((child, False)
+                             for child in self.children.get(node_id, []))
+                continue
+
+            technicians = set()
+
+            if self.is_technician(node_id):
+                technicians.add(node_id)
+
+            for child in self.children.get(node_id, []):
+                technicians |= subtrees.get(child, frozenset())
+
+            subtrees[node_id] = frozenset(technicians)
+
+        return subtrees
+
+    def report_nodes(self, strategy, technician_ids):
+        """Return the sorted node ids to request reports for so that every
+        technician in `technician_ids` is covered exactly once.
+
+        With the 'root' strategy that's the top of the tree, with 'group'
+        it's the highest groups that hold technicians. Technicians outside
+        of those are requested on their own."""
+        wanted = set(technician_ids)
+
+        if strategy == 'root':
+            candidates = self.roots()
+        else:
+            candidates = self.top_groups()
+
+        selected = []
+        covered = set()
+
+        for node_id in candidates:
+            technicians = self.technicians_under(node_id) & wanted
+
+            if technicians:
+                selected.append(node_id)
+                covered |= technicians
+
+        return sorted(selected + list(wanted - covered))
+
+    def top_groups(self):
+        groups = []
+        stack = list(self.roots())
+
+        while stack:
+            node_id = stack.pop()
+
+            if self.is_group(node_id):
+                groups.append(node_id)
+            else:
+                stack.extend(self.children.get(node_id, []))
+
+        return groups
+
+    def report_children(self, node_id, technician_ids):
+        """Return the children of `node_id` to request reports for when
+        the report for `node_id` itself can't be used."""
+        wanted = set(technician_ids)
+
+        return sorted(child for child in self.children.get(node_id, [])
+                      if self.technicians_under(child) & wanted)
@@ -0,0 +1,248 @@
+import decimal
+import json
+import sys
+import threading
+import time
+
+from tap_logmeinrescue.export import Exporter
+from tap_logmeinrescue.logger import LOGGER
+
+DEFAULT_BUFFER_BYTES = 1024 * 1024
+DEFAULT_FLUSH_SECONDS = 1.0
+
+# Tried in order when `output_encoder` is 'auto'.
+ENCODERS = ('orjson', 'ujson', 'simplejson', 'json')
+
+
+def encode_default(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def get_encoder(name='auto'):
+    """Return `(name, encode)` where `encode` turns a message into a
+    line of JSON. The fast encoders are optional dependencies, install
+    `tap-logmeinrescue[fast]` to get orjson."""
+    names = ENCODERS if name == 'auto' else (name,)
+
+    for candidate in names:
+        try:
+            if candidate == 'orjson':
+                import orjson
+
+                return candidate, lambda message: orjson.dumps(
+                    message, default=encode_default).decode('utf-8')
+
+            if candidate == 'ujson':
+                import ujson
+
+                return candidate, lambda message: ujson.dumps(
+                    message, ensure_ascii=False)
+
+            if candidate == 'simplejson':
+                import simplejson
+
+                return candidate, lambda message: simplejson.dumps(
+                    message, use_decimal=True)
+
+            if candidate == 'json':
+                return candidate, lambda message: json.dumps(
+                    message, default=encode_default)
+
+        except ImportError:
+            continue
+
+    raise RuntimeError('Unknown or unavailable output_encoder: {}'
+                       .format(name))
+
+
+class OutputWriter:
+    """Writes Singer messages to stdout through a buffer.
+
+    Messages are encoded as they're written and flushed once the buffer
+    holds `buffer_bytes` or `flush_seconds` have passed since the last
+    flush. A STATE message is always flushed with everything written
+    before it, so a target never sees a state ahead of its records. Safe
+    to share between threads.
+
+    With an `exporter`, the rows of the streams it exports are written to
+    files instead, and only the BATCH messages announcing the files go to
+    stdout."""
+
+    def __init__(self, stream=None, encoder='auto',
+                 buffer_bytes=DEFAULT_BUFFER_BYTES,
+                 flush_seconds=DEFAULT_FLUSH_SECONDS, exporter=None):
+        self.stream = stream
+        self.encoder_name, self.encode = get_encoder(encoder)
+        self.exporter = exporter
+        self.buffer_bytes = int(buffer_bytes)
+        self.flush_seconds = float(flush_seconds)
+
+        self.buffer = []
+        self.buffered = 0
+        self.lock = threading.Lock()
+
+        self.started = time.monotonic()
+        self.last_flush = self.started
+        self.bytes_written = 0
+        self.records_written = 0
+        self.flushes = 0
+
+    @classmethod
+    def from_config(cls, config):
+        writer = cls(
+            encoder=config.get('output_encoder', 'auto'),
+            buffer_bytes=config.get('output_buffer_bytes',
+                                    DEFAULT_BUFFER_BYTES),
+            flush_seconds=config.get('output_flush_seconds',
+                                     DEFAULT_FLUSH_SECONDS))
+        writer.exporter = Exporter.from_config(config, writer.encode)
+
+        return writer
+
+    def write_schema(self, stream, schema, key_properties):
+        if self.exporter is not None:
+            with self.lock:
+                self.exporter.set_schema(stream, schema)
+
+        self.write_message({
+            'type': 'SCHEMA',
+            'stream': stream,
+            'schema': schema,
+            'key_properties': key_properties,
+        })
+
+    def write_record(self, stream, record):
+        self.write_records(stream, [record])
+
+    def start_report(self, stream, start_date, end_date, headers):
+        """Tell the exporter, if there's one, which window the rows of
+        `stream` that follow are from."""
+        if self.exporter is None:
+            return
+
+        with self.lock:
+            self.append_messages(self.exporter.start_report(
+                stream, start_date, end_date, headers))
+
+    def write_records(self, stream, records):
+        if self.exporter is not None and self.exporter.exports(stream):
+            with self.lock:
+                self.append_messages(self.exporter.write(
+                    stream, list(records)))
+            return
+
+        lines = [self.encode({'type': 'RECORD',
+                              'stream': stream,
+                              'record': record})
+                 for record in records]
+
+        with self.lock:
+            self.records_written += len(lines)
+            self.append(lines)
+
+    def write_state(self, state):
+        line = self.encode({'type': 'STATE', 'value': state})
+
+        with self.lock:
+            self.finish_exports()
+            self.append([line], force=True)
+
+    def write_message(self, message):
+        line = self.encode(message)
+
+        with self.lock:
+            self.append([line])
+
+    def append_messages(self, messages):
+        if messages:
+            self.append([self.encode(message) for message in messages])
+
+    def finish_exports(self):
+        if self.exporter is not None:
+            self.append_messages(self.exporter.finish())
+
+    def append(self, lines, force=False):
+        for line in lines:
+            self.buffer.append(line)
+            self.buffer.append('\n')
+            self.buffered += len(line) + 1
+
+        if force or self.buffered >= self.buffer_bytes or \
+           time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush_buffer()
+
+    def flush(self):
+        with self.lock:
+            self.finish_exports()
+            self.flush_buffer()
+
+    def flush_buffer(self):
+        stream = self.stream or sys.stdout
+
+        if self.buffer:
+            stream.write(''.join(self.buffer))
+            self.bytes_written += self.buffered
+            self.flushes += 1
+            self.buffer = []
+            self.buffered = 0
+
+        stream.flush()
+        self.last_flush = time.monotonic()
+
+    def log_stats(self):
+        with self.lock:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+
+            LOGGER.info(
+                'Output: %s records, %s bytes in %s flushes using %s '
+                '(%.0f records/s, %.0f bytes/s).',
+                self.records_written, self.bytes_written, self.flushes,
+                self.encoder_name, self.records_written / elapsed,
+                self.bytes_written / elapsed)
+
+            if self.exporter is not None:
+                self.exporter.log_stats()
+
+
+WRITER = OutputWriter()
+
+
+def configure(config):
+    """Replace the module's writer with one built from `config`."""
+    global WRITER
+
+    WRITER.flush()
+    WRITER = OutputWriter.from_config(config)
+
+    return WRITER
+
+
+def write_schema(stream, schema, key_properties):
+    WRITER.write_schema(stream, schema, key_properties)
+
+
+def start_report(stream, start_date, end_date, headers):
+    WRITER.start_report(stream, start_date, end_date, headers)
+
+
+def write_record(stream, record):
+    WRITER.write_record(stream, record)
+
+
+def write_records(stream, records):
+    WRITER.write_records(stream, records)
+
+
+def write_state(state):
+    WRITER.write_state(state)
+
+
+def flush():
+    WRITER.flush()
+
+
+def log_stats():
+    WRITER.log_stats()
@@ -0,0 +1,241 @@
+import collections
+import copy
+import math
+
+from dateutil.parser import parse
+
+from tap_framework.config import get_config_start_date
+from tap_logmeinrescue.logger import LOGGER
+from tap_logmeinrescue.sharding import seed_bookmarks
+from tap_logmeinrescue.state import get_last_record_value_for_table
+from tap_logmeinrescue.windows import DateWindowSizer
+
+# The report settings that don't change from one window to the next.
+SETTINGS_ENDPOINTS = ('setTimezone', 'setOutput')
+
+
+def format_date(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class StreamPlan:
+    """The windows and nodes a report stream would request reports for."""
+
+    def __init__(self, stream, bookmark_key, windows):
+        self.stream = stream
+        self.bookmark_key = bookmark_key
+        # [(start_date, end_date, node count)]
+        self.windows = windows
+        self.requests = collections.Counter()
+
+    @property
+    def units(self):
+        return sum(nodes for _, _, nodes in self.windows)
+
+    def to_dict(self):
+        return {
+            'stream': self.stream.TABLE,
+            'bookmarks': self.stream.get_bookmark_table(),
+            'node': self.bookmark_key,
+            'units': self.units,
+            'windows': [{'start_date': format_date(start_date),
+                         'end_date': format_date(end_date),
+                         'units': nodes}
+                        for start_date, end_date, nodes in self.windows],
+            'requests': dict(self.requests),
+        }
+
+
+class SyncPlan:
+    """What a sync would do from the current state: the windows and nodes
+    of each report stream and the requests they'd take, with an estimate of
+    the runtime from the latencies recorded by earlier syncs.
+
+    Windows are planned at `window_initial_days`, as nothing tells how a
+    sync would resize them. Technicians that `activity_index` would skip
+    and reports in `report_cache_dir` are counted as requests."""
+
+    def __init__(self, config, state, history):
+        self.config = config
+        # Planning seeds shard bookmarks, the real state is left alone.
+        self.state = copy.deepcopy(state)
+        self.history = history
+        self.streams = []
+
+    def plan_streams(self, streams, technician_ids):
+        """Plan `streams` up to the same end date, as a sync of them
+        would, so the windows they share line up."""
+        final_end_date = min(stream.get_final_end_date()
+                             for stream in streams)
+
+        for stream in streams:
+            self.plan_stream(stream, technician_ids, final_end_date)
+
+    def plan_stream(self, stream, technician_ids, final_end_date=None):
+        stream.state = self.state
+
+        if stream.shard is not None:
+            seed_bookmarks(self.state, stream.TABLE, stream.shard)
+
+        bookmark_table = stream.get_bookmark_table()
+        start_date = get_last_record_value_for_table(
+            self.state, bookmark_table, 'start_date')
+        start_date = parse(start_date) if start_date \
+            else get_config_start_date(self.config)
+
+        bookmark_key, node_ids = stream.get_report_nodes(technician_ids)
+        node_bookmark = get_last_record_value_for_table(
+            self.state, bookmark_table, bookmark_key) or 0
+        resume_end_date = get_last_record_value_for_table(
+            self.state, bookmark_table, 'end_date')
+        resume_end_date = parse(resume_end_date) if resume_end_date \
+            else None
+
+        sizer = DateWindowSizer.from_config(self.config)
+        windows = []
+
+        if final_end_date is None:
+            final_end_date = stream.get_final_end_date()
+
+        while True:
+            end_date = sizer.next_end_date(start_date, final_end_date)
+
+            if resume_end_date is not None and resume_end_date > start_date:
+                end_date = min(resume_end_date, final_end_date)
+
+            windows.append((start_date, end_date, len(
+                [node_id for node_id in node_ids
+                 if node_id >= node_bookmark])))
+
+            if end_date >= final_end_date:
+                break
+
+            node_bookmark = 0
+            resume_end_date = None
+            start_date = end_date
+
+        self.streams.append(StreamPlan(stream, bookmark_key, windows))
+
+    def count_requests(self):
+        """Fill in the requests of each stream, returning the total by
+        endpoint."""
+        workers = max(int(self.config.get('report_workers', 1)), 1)
+        stream_workers = min(
+            int(self.config.get('report_stream_workers', 1)),
+            len(self.streams))
+        combined = self.config.get('report_sweep', 'stream') == 'combined' \
+            and len(self.streams) > 1
+        block_size = self.config.get('sweep_block_size')
+
+        total = collections.Counter({'login': 1, 'getHierarchy_v2': 1})
+        windows_seen = set()
+        blocks_seen = 0
+
+        for index, plan in enumerate(self.streams):
+            # Each report worker is an API session of its own.
+            sessions = 1 if combined or workers == 1 else workers
+            own_session = stream_workers > 1 and not combined
+            requests = plan.requests
+
+            # The sync's own session is one of the workers.
+            if sessions > 1:
+                requests['login'] += sessions - 1
+            elif own_session:
+                requests['login'] += 1
+
+            # Settings are sent again for each report area, except in the
+            # combined sweep, which shares them between the areas.
+            settings_sessions = 0 if combined and index > 0 else sessions
+
+            if not combined:
+                requests['setReportArea_v8'] += sessions
+
+            for endpoint in SETTINGS_ENDPOINTS:
+                requests[endpoint] += settings_sessions
+
+            for start_date, end_date, nodes in plan.windows:
+                if not nodes:
+                    continue
+
+                requests['getReport_v2'] += nodes
+
+                if not combined:
+                    requests['setReportDate_v2'] += min(sessions, nodes)
+                    continue
+
+                # The combined sweep sends the dates once per window, and
+                # changes report area once per stream and block.
+                blocks = math.ceil(nodes / int(block_size)) \
+                    if block_size else 1
+                requests['setReportArea_v8'] += blocks
+
+                if (start_date, end_date) not in windows_seen:
+                    windows_seen.add((start_date, end_date))
+                    requests['setReportDate_v2'] += 1
+                    blocks_seen += blocks
+
+            total.update(requests)
+
+        # Going through the streams backwards every other block, the area
+        # carries over from one block to the next.
+        if combined and blocks_seen:
+            total['setReportArea_v8'] -= blocks_seen - 1
+
+        return total
+
+    def estimate_seconds(self, total):
+        """Return the estimated runtime, or None without any recorded
+        latency to go by."""
+        endpoints = self.history.get('endpoints', {})
+        units = self.history.get('units', {})
+
+        if not endpoints and not units:
+            return None
+
+        workers = max(int(self.config.get('report_workers', 1)), 1)
+        stream_workers = min(
+            max(int(self.config.get('report_stream_workers', 1)), 1),
+            max(len(self.streams), 1))
+
+        def latency(endpoint):
+            return endpoints.get(endpoint, {}).get('mean', 0)
+
+        fixed = latency('login') + latency('getHierarchy_v2')
+        streams = 0.0
+
+        for plan in self.streams:
+            seconds = sum(count * latency(endpoint)
+                          for endpoint, count in plan.requests.items()
+                          if endpoint != 'getReport_v2')
+            per_unit = units.get(plan.stream.TABLE, {}).get('mean')
+
+            if per_unit is None:
+                per_unit = latency('getReport_v2')
+
+            streams += (seconds + plan.units * per_unit) / workers
+
+        seconds = fixed + streams / stream_workers
+        requests_per_second = self.config.get('requests_per_second')
+
+        # The rate limit is a floor on the runtime, however it's spread.
+        if requests_per_second:
+            seconds = max(seconds, sum(total.values()) /
+                          float(requests_per_second))
+
+        return seconds
+
+    def to_dict(self):
+        total = self.count_requests()
+        seconds = self.estimate_seconds(total)
+
+        if seconds is None:
+            LOGGER.warning('No recorded latencies to estimate the runtime '
+                           'from, a sync records them.')
+
+        return {
+            'streams': [plan.to_dict() for plan in self.streams],
+            'units': sum(plan.units for plan in self.streams),
+            'requests': dict(total, total=sum(total.values())),
+            'estimated_seconds': None if seconds is None
+            else round(seconds, 1),
+        }
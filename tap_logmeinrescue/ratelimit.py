@@ -0,0 +1,103 @@
+import email.utils
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+
+class RateLimiter:
+    """A token bucket shared by every API session of a run.
+
+    Each request takes a token, tokens refill at `rate` per second up to
+    `burst`. Without a rate only pauses are enforced: after a 429 every
+    session holds off until the pause is over, not just the one that was
+    throttled."""
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = float(rate) if rate else None
+        self.capacity = float(burst) if burst else max(self.rate or 1, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(rate=config.get('requests_per_second'),
+                   burst=config.get('burst'))
+
+    def acquire(self):
+        """Wait for a token, returning the number of seconds waited."""
+        with self.lock:
+            now = time.monotonic()
+            wait = max(self.paused_until - now, 0)
+
+            if self.rate is not None:
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                self.tokens -= 1
+
+                if self.tokens < 0:
+                    wait = max(wait, -self.tokens / self.rate)
+
+        if wait > 0:
+            time.sleep(wait)
+
+        return wait
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until,
+                                    time.monotonic() + seconds)
+
+
+class RetryBudget:
+    """The number of retries left for the whole run, shared by every API
+    session. `None` means unlimited."""
+
+    def __init__(self, retries=None):
+        self.remaining = int(retries) if retries is not None else None
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            if self.remaining is None:
+                return True
+
+            if self.remaining <= 0:
+                return False
+
+            self.remaining -= 1
+            return True
+
+
+def backoff_delay(attempt, base, cap):
+    """Exponential backoff with jitter: somewhere between half and all of
+    `base * 2 ** (attempt - 1)`, capped at `cap`."""
+    delay = min(cap, base * 2 ** (attempt - 1))
+
+    return delay * random.uniform(0.5, 1.0)
+
+
+def parse_retry_after(value):
+    """Return the number of seconds a Retry-After header asks for, or None
+    if it's missing or can't be parsed."""
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
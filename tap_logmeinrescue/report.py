@@ -0,0 +1,66 @@
+import xml.etree.ElementTree as ET
+
+
+class ReportReader:
+    """Incrementally parse a getReport_v2 XML payload.
+
+    The header is read as soon as the reader is created, rows are then
+    produced one at a time by `rows()` and discarded once consumed so the
+    memory used doesn't depend on the size of the report.
+
+    `chunks` is an iterable of str or bytes pieces of the document."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.parser = ET.XMLPullParser(events=('start', 'end'))
+        self.events = self.read_events()
+        self.headers = self.read_headers()
+
+    def read_events(self):
+        for chunk in self.chunks:
+            self.parser.feed(chunk)
+            yield from self.parser.read_events()
+
+        self.parser.close()
+        yield from self.parser.read_events()
+
+    def close(self):
+        """Stop reading, releasing the source of the chunks."""
+        self.events.close()
+
+        if hasattr(self.chunks, 'close'):
+            self.chunks.close()
+
+    def read_headers(self):
+        """Return a map of field id to header text, in document order."""
+        for event, elem in self.events:
+            if event == 'end' and elem.tag == 'header':
+                return {field.attrib['id']: field.text for field in elem}
+
+        return {}
+
+    def rows(self):
+        """Yield each row as a dict of header text to value."""
+        headers = self.headers
+
+        for values in self.values():
+            yield {headers[field_id]: value
+                   for field_id, value in values.items()}
+
+    def values(self):
+        """Yield each row as a dict of field id to value."""
+        container = None
+
+        for event, elem in self.events:
+            if event == 'start' and elem.tag == 'data':
+                container = elem
+
+            elif event == 'end' and elem.tag == 'row':
+                yield {field.attrib['id']: field.text for field in elem}
+
+                # Drop the rows we're done with, they'd otherwise stay
+                # attached to the tree until the end of the document.
+                if container is not None:
+                    container.clear()
+                else:
+                    elem.clear()
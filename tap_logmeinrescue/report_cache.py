@@ -0,0 +1,240 @@
+import gzip
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import pytz
+
+from tap_logmeinrescue.logger import LOGGER
+from tap_logmeinrescue.snapshot import account_fingerprint
+
+CACHE_MODES = ('readwrite', 'write', 'replay')
+DEFAULT_MAX_MB = 1024
+DATE_FORMAT = '%Y%m%dT%H%M%S'
+SUFFIX = '.gz'
+HIERARCHY = 'hierarchy'
+
+
+def format_date(value):
+    return value.strftime(DATE_FORMAT)
+
+
+def parse_date(value):
+    return pytz.utc.localize(datetime.strptime(value, DATE_FORMAT))
+
+
+class ReportCache:
+    """Raw API responses kept gzipped on local disk, so that windows can be
+    parsed again without requesting them from the API.
+
+    Reports are stored one file per report area, node and window, named
+    `<area>-<node>-<start>-<end>.gz`, next to the hierarchy. Once the files
+    add up to more than `max_bytes` the least recently used ones are
+    removed.
+
+    With the 'readwrite' mode a report that's already cached is read from
+    disk instead of the API, with 'write' the API is always used and the
+    cache refreshed, and with 'replay' nothing is requested at all."""
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_MB * 1024 * 1024,
+                 mode='readwrite'):
+        if mode not in CACHE_MODES:
+            raise Exception(
+                "Unknown report_cache_mode '{}', expected one of: {}"
+                .format(mode, ', '.join(CACHE_MODES)))
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+        # name -> [size, last used]
+        self.entries = {}
+
+        for entry in os.scandir(directory):
+            if entry.name.endswith(SUFFIX) and entry.is_file():
+                stat = entry.stat()
+                self.entries[entry.name[:-len(SUFFIX)]] = \
+                    [stat.st_size, stat.st_mtime]
+
+    @classmethod
+    def from_config(cls, config):
+        """Return the cache configured by `report_cache_dir`, or None. Each
+        account's reports are kept in a directory of their own under it."""
+        directory = config.get('report_cache_dir')
+
+        if not directory:
+            return None
+
+        directory = os.path.join(directory, account_fingerprint(config))
+
+        max_mb = float(config.get('report_cache_max_mb', DEFAULT_MAX_MB))
+
+        return cls(directory, int(max_mb * 1024 * 1024),
+                   config.get('report_cache_mode', 'readwrite'))
+
+    @property
+    def replay(self):
+        return self.mode == 'replay'
+
+    @staticmethod
+    def report_name(area, node_id, start_date, end_date):
+        return '{}-{}-{}-{}'.format(area, node_id, format_date(start_date),
+                                    format_date(end_date))
+
+    def path(self, name):
+        return os.path.join(self.directory, name + SUFFIX)
+
+    def get(self, name):
+        """Return an iterator over the cached response `name`, or None."""
+        with self.lock:
+            entry = self.entries.get(name)
+
+            if self.mode == 'write' or entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entry[1] = time.time()
+
+        try:
+            # The modification time doubles as the last use, so the LRU
+            # order carries over to the next run.
+            os.utime(self.path(name))
+        except OSError:
+            pass
+
+        return self.read(name)
+
+    def read(self, name):
+        with gzip.open(self.path(name), 'rb') as handle:
+            while True:
+                chunk = handle.read(64 * 1024)
+
+                if not chunk:
+                    break
+
+                yield chunk
+
+    def covering(self, area, node_id, start_date, end_date):
+        """Return the names of the cached reports for `area` and `node_id`
+        that tile the window from `start_date` to `end_date`, in order.
+        Replayed windows don't have to match the ones that were cached, but
+        each cached report has to fall entirely inside one of them: a
+        window the cached reports don't tile raises an error, so it's never
+        bookmarked as synced."""
+        prefix = '{}-{}-'.format(area, node_id)
+        windows = []
+
+        with self.lock:
+            names = [name for name in self.entries
+                     if name.startswith(prefix)]
+
+        for name in names:
+            cached_start, cached_end = [
+                parse_date(value) for value in name[len(prefix):].split('-')]
+
+            if cached_start >= start_date and cached_end <= end_date:
+                windows.append((cached_start, cached_end, name))
+
+        covered = start_date
+        selected = []
+
+        for cached_start, cached_end, name in sorted(windows):
+            if cached_start != covered:
+                continue
+
+            selected.append(name)
+            covered = cached_end
+
+        if covered < end_date:
+            raise Exception(
+                'No cached report for node {} from {} to {} to replay the '
+                'window from {} to {}. Replay with windows that start and '
+                'end where the cached ones do, or sync the window again '
+                'with another report_cache_mode.'.format(
+                    node_id, covered, end_date, start_date, end_date))
+
+        return selected
+
+    def replay_end_date(self, area, default):
+        """Return the latest end of the cached reports for `area`, if it's
+        before `default`, so replays stop where the cache does."""
+        prefix = '{}-'.format(area)
+
+        with self.lock:
+            ends = [parse_date(name.rsplit('-', 1)[1])
+                    for name in self.entries if name.startswith(prefix)]
+
+        return min(max(ends), default) if ends else default
+
+    def record(self, name, chunks):
+        """Yield `chunks`, storing them as `name` once they've all been
+        read. A response that isn't read to the end isn't stored."""
+        handle = tempfile.NamedTemporaryFile(
+            dir=self.directory, suffix='.tmp', delete=False)
+        complete = False
+
+        try:
+            with gzip.GzipFile(fileobj=handle, mode='wb',
+                               compresslevel=6) as compressed:
+                for chunk in chunks:
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode('utf-8')
+
+                    compressed.write(chunk)
+                    yield chunk
+
+            complete = True
+
+        finally:
+            handle.close()
+
+            if complete:
+                os.replace(handle.name, self.path(name))
+                self.add(name, os.path.getsize(self.path(name)))
+            else:
+                os.remove(handle.name)
+
+    def add(self, name, size):
+        with self.lock:
+            self.entries[name] = [size, time.time()]
+            total = sum(size for size, _ in self.entries.values())
+
+            if total <= self.max_bytes:
+                return
+
+            evicted = []
+
+            for oldest, (oldest_size, _) in sorted(
+                    self.entries.items(), key=lambda item: item[1][1]):
+                if total <= self.max_bytes:
+                    break
+
+                total -= oldest_size
+                evicted.append(oldest)
+
+            for oldest in evicted:
+                del self.entries[oldest]
+
+        for oldest in evicted:
+            try:
+                os.remove(self.path(oldest))
+            except OSError:
+                pass
+
+        LOGGER.info('Evicted %s reports from the report cache.', len(evicted))
+
+    def log_stats(self):
+        with self.lock:
+            total = sum(size for size, _ in self.entries.values())
+
+            LOGGER.info('Report cache: %s hits, %s misses, %s files, '
+                        '%.1f MiB.', self.hits, self.misses,
+                        len(self.entries), total / 1024 / 1024)
@@ -0,0 +1,84 @@
+import json
+import os
+import tempfile
+import time
+
+from tap_logmeinrescue.logger import LOGGER
+from tap_logmeinrescue.snapshot import account_fingerprint
+
+DEFAULT_TTL_HOURS = 24
+
+
+class SchemaCache:
+    """Report headers discovered from the API, kept on disk for a while so
+    that discovery doesn't have to request a live report every time.
+
+    The cache is only used when `schema_cache` is set. By default each
+    account has a file of its own in the temporary directory, which holds a
+    JSON object of key to `{"headers": [...], "cached_at": <unix time>}`."""
+
+    def __init__(self, path, ttl_hours=DEFAULT_TTL_HOURS):
+        self.path = path
+        self.ttl = float(ttl_hours) * 60 * 60
+
+    @classmethod
+    def from_config(cls, config):
+        """Return the cache configured, which never holds anything unless
+        `schema_cache` is set."""
+        path = config.get('schema_cache_path')
+
+        if path is None:
+            path = os.path.join(
+                tempfile.gettempdir(),
+                'tap-logmeinrescue-schemas-{}.json'.format(
+                    account_fingerprint(config)))
+
+        ttl_hours = config.get('schema_cache_ttl_hours', DEFAULT_TTL_HOURS) \
+            if config.get('schema_cache') else 0
+
+        return cls(path, ttl_hours)
+
+    @staticmethod
+    def key(config, report_area):
+        return '{}:{}'.format(account_fingerprint(config), report_area)
+
+    def load(self):
+        try:
+            with open(self.path) as handle:
+                return json.load(handle)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def get(self, key):
+        if self.ttl <= 0:
+            return None
+
+        entry = self.load().get(key)
+
+        if entry is None or time.time() - entry['cached_at'] > self.ttl:
+            return None
+
+        return entry['headers']
+
+    def put(self, key, headers):
+        if self.ttl <= 0:
+            return
+
+        entries = self.load()
+        entries[key] = {'headers': headers, 'cached_at': time.time()}
+
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+
+            # Written to the side and moved into place so that a
+            # concurrent discovery never reads half a file.
+            with tempfile.NamedTemporaryFile(
+                    'w', dir=directory, delete=False) as handle:
+                json.dump(entries, handle)
+
+            os.replace(handle.name, self.path)
+
+        except (IOError, OSError) as e:
+            LOGGER.warning('Could not write the schema cache to %s: %s',
+                           self.path, e)
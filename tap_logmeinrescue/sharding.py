@@ -0,0 +1,221 @@
+import argparse
+import json
+import sys
+
+from dateutil.parser import parse
+
+from tap_logmeinrescue.logger import LOGGER
+from tap_logmeinrescue.state import STATE_LOCK
+
+SEPARATOR = '@'
+
+
+class Shard:
+    """The part of the account one tap process syncs, when an account is
+    spread over several processes.
+
+    A shard is either one of `count` partitions, taking the node ids for
+    which `node_id % count == index`, or an explicit, inclusive range of
+    node ids. Node ids are technician ids, or group ids with the 'group' and
+    'root' fetch strategies.
+
+    Each stream keeps the bookmarks of a shard under its own key in the
+    state, `<table>@<shard name>`, so shards never touch each other's
+    bookmarks and their states can be merged with `merge_states`."""
+
+    def __init__(self, index=None, count=None, min_id=None, max_id=None):
+        self.index = index
+        self.count = count
+        self.min_id = min_id
+        self.max_id = max_id
+
+        if count is not None:
+            if index is None or not 0 <= index < count:
+                raise Exception(
+                    'shard_index must be between 0 and shard_count - 1, '
+                    'got {} of {}'.format(index, count))
+
+            if min_id is not None or max_id is not None:
+                raise Exception(
+                    'Use either shard_count and shard_index or a '
+                    'technician id range, not both.')
+
+        elif min_id is None and max_id is None:
+            raise Exception(
+                'A shard needs shard_count and shard_index, or a '
+                'technician id range.')
+
+    @classmethod
+    def from_config(cls, config):
+        """Return the shard configured, or None when the whole account is
+        synced."""
+        count = config.get('shard_count')
+        index = config.get('shard_index')
+        min_id = config.get('shard_technician_id_min')
+        max_id = config.get('shard_technician_id_max')
+
+        if count is None and index is None and \
+           min_id is None and max_id is None:
+            return None
+
+        def to_int(value):
+            return int(value) if value is not None else None
+
+        return cls(to_int(index), to_int(count), to_int(min_id),
+                   to_int(max_id))
+
+    @property
+    def name(self):
+        if self.count is not None:
+            return 'shard-{}-of-{}'.format(self.index, self.count)
+
+        return 'shard-{}-to-{}'.format(
+            'min' if self.min_id is None else self.min_id,
+            'max' if self.max_id is None else self.max_id)
+
+    def owns(self, node_id):
+        node_id = int(node_id)
+
+        if self.count is not None:
+            return node_id % self.count == self.index
+
+        return (self.min_id is None or node_id >= self.min_id) and \
+            (self.max_id is None or node_id <= self.max_id)
+
+    def select(self, node_ids):
+        return [node_id for node_id in node_ids if self.owns(node_id)]
+
+    def bookmark_table(self, table):
+        return '{}{}{}'.format(table, SEPARATOR, self.name)
+
+
+def seed_bookmarks(state, table, shard):
+    """Start a shard that has no bookmarks of its own from the bookmarks of
+    an unsharded sync, so switching to shards doesn't sync everything again.
+    Only completed windows and the activity of the shard's own technicians
+    carry over."""
+    with STATE_LOCK:
+        bookmarks = state.setdefault('bookmarks', {})
+        shard_table = shard.bookmark_table(table)
+
+        if shard_table in bookmarks or table not in bookmarks:
+            return state
+
+        unsharded = bookmarks[table]
+        seeded = {}
+
+        if unsharded.get('start_date') is not None:
+            seeded['start_date'] = unsharded['start_date']
+
+        if unsharded.get('activity'):
+            seeded['activity'] = {
+                node_id: entry
+                for node_id, entry in unsharded['activity'].items()
+                if shard.owns(node_id)}
+
+            if unsharded.get('activity_full_sweep_at') is not None:
+                seeded['activity_full_sweep_at'] = \
+                    unsharded['activity_full_sweep_at']
+
+        if seeded:
+            LOGGER.info('Starting %s from the unsharded bookmarks of %s.',
+                        shard_table, table)
+            bookmarks[shard_table] = seeded
+
+    return state
+
+
+def merge_states(states):
+    """Fold the states of several shards into one.
+
+    Every shard's bookmarks are kept, so the merged state can be given to
+    each shard again. Each table also gets unsharded bookmarks that an
+    unsharded sync can resume from: the earliest `start_date` any shard is
+    at, provided every shard has one, and the activity of every shard's
+    technicians. Partly synced windows are synced again from the start."""
+    merged = {'bookmarks': {}}
+    shards = {}
+
+    for state in states:
+        for key, value in (state or {}).get('bookmarks', {}).items():
+            if SEPARATOR not in key:
+                continue
+
+            table, name = key.split(SEPARATOR, 1)
+            merged['bookmarks'][key] = value
+            shards.setdefault(table, {})[name] = value
+
+    for table, by_name in sorted(shards.items()):
+        check_coverage(table, by_name)
+        bookmarks = list(by_name.values())
+        unsharded = {}
+
+        start_dates = [item.get('start_date') for item in bookmarks]
+
+        if all(start_dates):
+            unsharded['start_date'] = min(start_dates, key=parse)
+
+        activity = {}
+
+        for item in bookmarks:
+            activity.update(item.get('activity') or {})
+
+        if activity:
+            unsharded['activity'] = activity
+            full_sweeps = [item['activity_full_sweep_at']
+                           for item in bookmarks
+                           if item.get('activity_full_sweep_at')]
+
+            if full_sweeps:
+                unsharded['activity_full_sweep_at'] = \
+                    min(full_sweeps, key=parse)
+
+        if unsharded:
+            merged['bookmarks'][table] = unsharded
+
+    return merged
+
+
+def check_coverage(table, by_name):
+    """Warn when the states given for `table` can't be the whole account,
+    e.g. a shard's state is missing."""
+    counts = {}
+
+    for name in by_name:
+        parts = name.split('-')
+
+        if len(parts) == 4 and parts[2] == 'of':
+            counts.setdefault(int(parts[3]), set()).add(int(parts[1]))
+
+    if len(counts) > 1:
+        LOGGER.warning('The states for %s come from different shard '
+                       'counts: %s.', table, sorted(counts))
+
+    for count, indexes in counts.items():
+        missing = sorted(set(range(count)) - indexes)
+
+        if missing:
+            LOGGER.warning('No state for %s from shards %s of %s.',
+                           table, ', '.join(str(i) for i in missing), count)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Merge the states of sharded tap-logmeinrescue syncs '
+                    'and write the result to stdout.')
+    parser.add_argument('states', nargs='+', metavar='STATE',
+                        help='state file written by one shard')
+    args = parser.parse_args()
+
+    states = []
+
+    for path in args.states:
+        with open(path) as handle:
+            states.append(json.load(handle))
+
+    json.dump(merge_states(states), sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
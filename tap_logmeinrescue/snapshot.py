@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from dateutil.parser import parse
+
+from tap_logmeinrescue.logger import LOGGER
+
+DEFAULT_FULL_REFRESH_HOURS = 24
+
+
+def fingerprint(record):
+    """A short hash of a record's values, to tell whether it changed."""
+    encoded = json.dumps(record, sort_keys=True, default=str)
+
+    return hashlib.blake2b(encoded.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def account_fingerprint(config):
+    """A short hash of the account `config` logs in to, to keep what's
+    cached for different accounts apart."""
+    return fingerprint([config.get('api_base_url'), config.get('username')])
+
+
+class HierarchySnapshot:
+    """The technicians emitted by the last sync, as a map of node id to
+    fingerprint, kept in a local file.
+
+    The file only stands for what the target has received if its digest
+    matches the one in the stream's bookmarks, which is written with the
+    state once the records have been emitted. A snapshot that doesn't match,
+    e.g. after the state was reset, is ignored and every technician is
+    emitted again."""
+
+    def __init__(self, path, full_refresh_hours=DEFAULT_FULL_REFRESH_HOURS):
+        self.path = path
+        self.full_refresh_hours = float(full_refresh_hours)
+
+    @classmethod
+    def from_config(cls, config, shard=None):
+        path = config.get('hierarchy_snapshot_path')
+
+        if path is None:
+            name = config.get('username')
+
+            # Shards on the same machine each keep their own snapshot.
+            if shard is not None:
+                name = [name, shard.name]
+
+            path = os.path.join(
+                tempfile.gettempdir(),
+                'tap-logmeinrescue-hierarchy-{}.json'.format(
+                    fingerprint(name)))
+
+        return cls(path, config.get('hierarchy_full_refresh_hours',
+                                    DEFAULT_FULL_REFRESH_HOURS))
+
+    def load(self, bookmarks, now):
+        """Return the fingerprints of the last snapshot, or None when every
+        technician should be emitted."""
+        digest = bookmarks.get('snapshot_digest')
+        refreshed_at = bookmarks.get('full_refresh_at')
+
+        if digest is None or refreshed_at is None:
+            return None
+
+        hours = (now - parse(refreshed_at)).total_seconds() / 3600
+
+        if hours >= self.full_refresh_hours:
+            LOGGER.info('Emitting every technician, the last full refresh '
+                        'was %.1f hours ago.', hours)
+            return None
+
+        try:
+            with open(self.path) as handle:
+                snapshot = json.load(handle)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if snapshot.get('digest') != digest:
+            LOGGER.info('The hierarchy snapshot at %s does not match the '
+                        'state, emitting every technician.', self.path)
+            return None
+
+        return snapshot['nodes']
+
+    def save(self, nodes):
+        """Write `nodes`, a map of node id to fingerprint, returning the
+        digest to keep in the state."""
+        digest = fingerprint(nodes)
+
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+
+            with tempfile.NamedTemporaryFile(
+                    'w', dir=directory, delete=False) as handle:
+                json.dump({'digest': digest, 'nodes': nodes}, handle)
+
+            os.replace(handle.name, self.path)
+
+        except (IOError, OSError) as e:
+            LOGGER.warning('Could not write the hierarchy snapshot to %s: %s',
+                           self.path, e)
+            return None
+
+        return digest
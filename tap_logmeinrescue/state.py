@@ -1,9 +1,20 @@
 import datetime
 import json
 import singer
+import threading
+import time
+
+from tap_logmeinrescue import output
 
 LOGGER = singer.get_logger()
 
+DEFAULT_CHECKPOINT_UNITS = 100
+DEFAULT_CHECKPOINT_SECONDS = 60
+
+# Held while the state is changed or written. Report streams synced at the
+# same time share one state, each only changing its own bookmarks.
+STATE_LOCK = threading.RLock()
+
 
 def get_last_record_value_for_table(state, table, field):
     last_value = state.get('bookmarks', {}) \
@@ -23,23 +34,18 @@ def incorporate(state, table, key, value, force=False):
     if isinstance(value, datetime.datetime):
         value = value.strftime('%Y-%m-%dT%H:%M:%SZ')
 
+    # The state is updated in place, copying it on every bookmark adds up
+    # over thousands of technicians.
     if state is None:
-        new_state = {}
-    else:
-        new_state = state.copy()
-
-    if 'bookmarks' not in new_state:
-        new_state['bookmarks'] = {}
+        state = {}
 
-    if table not in new_state['bookmarks']:
-        new_state['bookmarks'][table] = {}
+    with STATE_LOCK:
+        bookmarks = state.setdefault('bookmarks', {}).setdefault(table, {})
 
-    if(new_state['bookmarks'].get(table, {}).get(key) is None or
-       new_state['bookmarks'].get(table, {}).get(key) < value or
-       force):
-        new_state['bookmarks'][table][key] = value
+        if bookmarks.get(key) is None or bookmarks[key] < value or force:
+            bookmarks[key] = value
 
-    return new_state
+    return state
 
 
 def save_state(state):
@@ -50,7 +56,48 @@ def save_state(state):
 
     LOGGER.debug('%s', state)
 
-    singer.write_state(state)
+    with STATE_LOCK:
+        output.write_state(state)
+
+
+class Checkpointer:
+    """Decides when to write the state while syncing a stream.
+
+    Bookmarks are still updated after every unit of work, but the state is
+    only written every `units` units or `seconds` seconds, and whenever
+    `save` is called directly, e.g. at the end of a date window. A sync
+    that's interrupted resumes from the last state written and requests
+    the units since then again."""
+
+    def __init__(self, units=DEFAULT_CHECKPOINT_UNITS,
+                 seconds=DEFAULT_CHECKPOINT_SECONDS):
+        self.units = max(int(units), 1)
+        self.seconds = float(seconds)
+        self.pending = 0
+        self.last_saved = time.monotonic()
+        self.saved = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            units=config.get('state_checkpoint_units',
+                             DEFAULT_CHECKPOINT_UNITS),
+            seconds=config.get('state_checkpoint_seconds',
+                               DEFAULT_CHECKPOINT_SECONDS))
+
+    def unit_done(self, state):
+        self.pending += 1
+
+        if self.pending >= self.units or \
+           time.monotonic() - self.last_saved >= self.seconds:
+            self.save(state)
+
+    def save(self, state):
+        save_state(state)
+
+        self.pending = 0
+        self.last_saved = time.monotonic()
+        self.saved += 1
 
 
 def load_state(filename):
@@ -1,64 +1,64 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import funcy
+import itertools
 import pytz
+import time
 import singer
 from singer import utils
-import xml.etree.ElementTree as ET
 
 from dateutil.parser import parse
 
 from tap_framework.streams import BaseStream
 from tap_framework.config import get_config_start_date
+from tap_logmeinrescue import output, timing
+from tap_logmeinrescue.activity import ActivityIndex
+from tap_logmeinrescue.client import ClientPool
+from tap_logmeinrescue.report import ReportReader
+from tap_logmeinrescue.report_cache import ReportCache
+from tap_logmeinrescue.schema_cache import SchemaCache
+from tap_logmeinrescue.windows import DateWindowSizer
+from tap_logmeinrescue.transform import RowTransformer
 from tap_logmeinrescue.state import get_last_record_value_for_table, \
-    incorporate, save_state
+    incorporate, Checkpointer
 
 from tap_logmeinrescue.logger import LOGGER
 
-def generate_date_windows(start_date, end_date=None):
-    """Yield 7 day windows from start_date to end_date.
-
-    Args:
-        start_date: A datetime object.
-        end_date: A datetime object > start_date. Defaults to utils.now()
-
-    With end_date as the default:
-    [x for x in generate_date_windows(
-                      utils.strptime_to_utc("2018-10-01T00:00:00Z"))]
-    [(datetime.datetime(2018, 10, 1, 0, 0, tzinfo=<UTC>),
-      datetime.datetime(2018, 10, 8, 0, 0, tzinfo=<UTC>)),
-     (datetime.datetime(2018, 10, 8, 0, 0, tzinfo=<UTC>),
-      datetime.datetime(2018, 10, 15, 0, 0, tzinfo=<UTC>)),
-     (datetime.datetime(2018, 10, 15, 0, 0, tzinfo=<UTC>),
-      datetime.datetime(2018, 10, 22, 0, 0, tzinfo=<UTC>)),
-     (datetime.datetime(2018, 10, 22, 0, 0, tzinfo=<UTC>),
-      datetime.datetime(2018, 10, 25, 16, 26, 10, 773289, tzinfo=<UTC>))]
-
-    With a passed end_date:
-    >>> [x for x in generate_date_windows(
-                      utils.strptime_to_utc("2018-10-01T00:00:00Z"),
-                      utils.strptime_to_utc("2018-10-25T00:00:00Z"))
-    [(datetime.datetime(2018, 10, 1, 0, 0, tzinfo=<UTC>),
-      datetime.datetime(2018, 10, 8, 0, 0, tzinfo=<UTC>)),
-     (datetime.datetime(2018, 10, 8, 0, 0, tzinfo=<UTC>),
-      datetime.datetime(2018, 10, 15, 0, 0, tzinfo=<UTC>)),
-     (datetime.datetime(2018, 10, 15, 0, 0, tzinfo=<UTC>),
-      datetime.datetime(2018, 10, 22, 0, 0, tzinfo=<UTC>)),
-     (datetime.datetime(2018, 10, 22, 0, 0, tzinfo=<UTC>),
-      datetime.datetime(2018, 10, 25, 0, 0, tzinfo=<UTC>))]"""
-    final_end_date = end_date if end_date else utils.now()
-    while True:
-        end_date = start_date + timedelta(days=7)
-        if end_date > final_end_date:
-            end_date = final_end_date
-            yield start_date, end_date
-            break
-        else:
-            yield start_date, end_date
-            start_date = end_date
+FETCH_STRATEGIES = ('technician', 'group', 'root')
+
+# How many rows of a report are parsed and transformed at a time.
+ROW_BATCH_SIZE = 100
+
+
+class ReportError(Exception):
+    """The API answered a report request with a status other than OK."""
 
 
 class BaseLogMeInRescueStream(BaseStream):
 
+    row_transformers = None
+    shard = None
+
+    def get_bookmark_table(self):
+        """The key the stream's bookmarks are kept under in the state."""
+        if self.shard is None:
+            return self.TABLE
+
+        return self.shard.bookmark_table(self.TABLE)
+
+    def sync(self):
+        try:
+            return super().sync()
+        finally:
+            output.flush()
+
+    def write_schema(self):
+        output.write_schema(
+            self.catalog.stream,
+            self.catalog.schema.to_dict(),
+            key_properties=self.catalog.key_properties)
+
     def convert_key(self, k):
         # replace disallowed characters used in keys
         k = k.replace('–', '')
@@ -80,13 +80,42 @@ class BaseLogMeInRescueStream(BaseStream):
 
         return super().transform_record(converted)
 
+    def get_row_transformer(self, headers):
+        """Return the compiled transformer for a layout of fields, building
+        it the first time that layout is seen."""
+        if self.row_transformers is None:
+            self.row_transformers = {}
+
+        key = tuple(headers.items())
+        transformer = self.row_transformers.get(key)
+
+        if transformer is None:
+            metadata = {}
+
+            if self.catalog.metadata is not None:
+                metadata = singer.metadata.to_map(self.catalog.metadata)
+
+            transformer = RowTransformer(
+                headers, self.catalog.schema.to_dict(), metadata,
+                self.convert_key)
+            self.row_transformers[key] = transformer
+
+        return transformer
+
 
 class BaseLogMeInRescueReportStream(BaseLogMeInRescueStream):
 
     REPORT_AREA = None
 
+    client_pool = None
+    hierarchy = None
+    report_cache = None
+    dedup = None
+    parent_ids = None
+    window_sizer = None
+
     def get_url(self):
-        return 'https://secure.logmeinrescue.com/API/getReport_v2.aspx'
+        return self.client.get_url('getReport_v2')
 
     def generate_catalog(self, technician_id):
         schema = self.get_schema(technician_id)
@@ -136,21 +165,91 @@ class BaseLogMeInRescueReportStream(BaseLogMeInRescueStream):
 
 
     def get_headers(self, technician_id):
+        cache = SchemaCache.from_config(self.config)
+        cache_key = self.get_schema_cache_key()
+        headers = cache.get(cache_key)
+
+        if headers is not None:
+            LOGGER.info('Using cached headers for %s.', self.TABLE)
+            return headers
+
         start_date = get_config_start_date(self.config)
         end_date = start_date + timedelta(days=7)
-        parsed_response = self.execute_request(technician_id, start_date, end_date)
-        return parsed_response['headers']
 
+        # Only the header block is read, the connection is dropped before
+        # any of the rows are downloaded.
+        reader = ReportReader(
+            self.request_report(technician_id, start_date, end_date))
+        reader.close()
+
+        headers = [self.convert_key(header)
+                   for header in reader.headers.values()]
+        cache.put(cache_key, headers)
+
+        return headers
+
+    def get_schema_cache_key(self):
+        return SchemaCache.key(self.config, self.REPORT_AREA)
+
+    def execute_request(self, parent_id, start_date, end_date, client=None):
+        if self.report_cache is not None and self.report_cache.replay:
+            return self.replay_report(parent_id, start_date, end_date)
+
+        return self.parse_data(self.request_report(
+            parent_id, start_date, end_date, client=client))
+
+    def get_final_end_date(self):
+        """Return the date this sync syncs up to: now, or where the cached
+        reports end when they're replayed."""
+        final_end_date = utils.now()
+
+        if self.report_cache is not None and self.report_cache.replay:
+            final_end_date = self.report_cache.replay_end_date(
+                self.REPORT_AREA, final_end_date)
+
+        return final_end_date
+
+    def replay_report(self, parent_id, start_date, end_date):
+        """Parse the cached reports that make up a window, without making
+        any request."""
+        names = self.report_cache.covering(
+            self.REPORT_AREA, parent_id, start_date, end_date)
+
+        if not names:
+            return {'headers': [], 'rows': iter(())}
+
+        first = self.parse_data(self.report_cache.read(names[0]))
+
+        def remaining_rows():
+            for name in names[1:]:
+                yield from self.parse_data(
+                    self.report_cache.read(name))['rows']
+
+        return {
+            'headers': first['headers'],
+            'rows': itertools.chain(first['rows'], remaining_rows()),
+        }
+
+    def request_report(self, parent_id, start_date, end_date, client=None):
+        """Configure and request a report, returning an iterator over the
+        chunks of its XML body."""
+        if client is None:
+            client = self.client
+
+        cache_name = None
+
+        if self.report_cache is not None:
+            cache_name = ReportCache.report_name(
+                self.REPORT_AREA, parent_id, start_date, end_date)
+            cached = self.report_cache.get(cache_name)
+
+            if cached is not None:
+                return cached
 
-    def execute_request(self, parent_id, start_date, end_date):
         # Sets the Report Type so that we generate a specific type of report
-        resp = self.client.make_request(
-            'https://secure.logmeinrescue.com/API/setReportArea_v8.aspx',
-            'POST',
-            params={'area': self.REPORT_AREA})
-        status = resp.split("\n\n", 1)[0]
-        if status != "OK":
-            raise Exception("Error with setReportArea request: {}".format(status))
+        client.set_report_area(
+            client.get_url('setReportArea_v8'),
+            self.REPORT_AREA)
 
         LOGGER.info(
             ('Fetching session report for technician {} '
@@ -158,130 +257,438 @@ class BaseLogMeInRescueReportStream(BaseLogMeInRescueStream):
             .format(parent_id, start_date, end_date))
 
         # Set the timezone for the report to ensure UTC
-        resp = self.client.make_request(
-            'https://secure.logmeinrescue.com/API/setTimezone.aspx',
-            'POST',
-            params={"timezone": 0})
-        status = resp.split("\n\n", 1)[0]
-        if status != "OK":
-            raise Exception("Error with setTimezone request: {}".format(status))
+        client.set_report_setting(
+            client.get_url('setTimezone'),
+            {"timezone": 0})
 
         # Sets the start and end date on the report to be generated
         report_dates = {'bdate': start_date.strftime('%-m/%-d/%Y %H:%M:%S'),
                         'edate': end_date.strftime('%-m/%-d/%Y %H:%M:%S')}
-        resp = self.client.make_request(
-            'https://secure.logmeinrescue.com/API/setReportDate_v2.aspx',  # noqa
-            'POST',
-            params=report_dates)
-        status = resp.split("\n\n", 1)[0]
-        if status != "OK":
-            raise Exception("Error with setReportDate request: {}".format(status))
+        client.set_report_setting(
+            client.get_url('setReportDate_v2'),
+            report_dates)
 
         # Set the report output to XML so that it can be
         # parsed. Text output is buggy as it does not properly
         # escape the field delimeter.
         output_type = 'XML'
-        self.client.make_request(
-            'https://secure.logmeinrescue.com/API/setOutput.aspx',
-            'POST',
-            params={'output': output_type})
-        status = resp.split("\n\n", 1)[0]
-        if status != "OK":
-            raise Exception("Error with setOutput request: {}".format(status))
+        client.set_report_setting(
+            client.get_url('setOutput'),
+            {'output': output_type})
 
         # Calls the generate report endpoint
         report_params = {'node': parent_id,
                          'nodetype': 'NODE'}
-        raw_response = self.client.make_request(
+        # The body is only read as the report is parsed, the response
+        # holds a status followed by two newlines and then the report.
+        status, data = client.stream_request(
             self.get_url(),
             'GET',
             params=report_params)
 
-        # The response will contain a status followed by two newlines
-        status, data = raw_response.split("\n\n", 1)
-
         if status != "OK":
             msg = "Error retrieving report: {}\nReport Params: {}\nReport Dates: {}".format(status, report_params, report_dates)
-            raise Exception(msg)
+            raise ReportError(msg)
 
-        return self.parse_data(data)
+        if cache_name is not None:
+            return self.report_cache.record(cache_name, data)
 
+        return data
 
-    def sync_data(self, parent_ids):
-        table = self.TABLE
 
+    def sync_data(self, parent_ids):
         self.write_schema()
 
+        try:
+            with timing.context(stream=self.TABLE):
+                self.sync_windows(parent_ids)
+        finally:
+            self.close_client_pool()
+
+    def sync_windows(self, parent_ids):
+        table = self.TABLE
+        bookmark_table = self.get_bookmark_table()
+
         start_date = get_last_record_value_for_table(
-            self.state, table, 'start_date')
+            self.state, bookmark_table, 'start_date')
 
         if start_date is None:
             start_date = get_config_start_date(self.config)
         else:
             start_date = parse(start_date)
 
-        technician_id = get_last_record_value_for_table(
-            self.state, table, 'technician_id')
+        self.parent_ids = parent_ids
+        bookmark_key, node_ids = self.get_report_nodes(parent_ids)
+
+        node_bookmark = get_last_record_value_for_table(
+            self.state, bookmark_table, bookmark_key)
+
+        if node_bookmark is None:
+            node_bookmark = 0
+
+        # A window that was interrupted is resumed with the end date it
+        # was started with, whatever size the next windows end up being.
+        resume_end_date = get_last_record_value_for_table(
+            self.state, bookmark_table, 'end_date')
 
-        if technician_id is None:
-            technician_id = 0
+        if resume_end_date is not None:
+            resume_end_date = parse(resume_end_date)
 
-        for start_date, end_date in generate_date_windows(start_date):
-            for index, parent_id in enumerate(parent_ids):
-                if parent_id < technician_id:
-                    continue
+        self.window_sizer = DateWindowSizer.from_config(self.config)
+        final_end_date = self.get_final_end_date()
 
-                LOGGER.info(
-                    'Fetching %s for technician %s (%s/%s) from %s to %s',
-                    table, parent_id, index + 1, len(parent_ids),
-                    start_date, end_date)
+        if start_date >= final_end_date:
+            LOGGER.info('Nothing to sync for %s before %s.', table,
+                        final_end_date)
+            return
 
-                parsed_response = self.execute_request(parent_id, start_date, end_date)
+        checkpointer = Checkpointer.from_config(self.config)
+        activity = None
 
-                with singer.metrics.record_counter(endpoint=table) as ctr:
-                    singer.write_records(table, parsed_response['rows'])
+        if bookmark_key == 'technician_id':
+            activity = ActivityIndex.from_state(
+                self.state, bookmark_table, self.config, self.hierarchy,
+                now=final_end_date)
 
-                    ctr.increment(amount=len(parsed_response['rows']))
+        while True:
+            end_date = self.window_sizer.next_end_date(
+                start_date, final_end_date)
 
-                # technician_id acts as a substream bookmark so that we
-                # can pick up in a single stream where we left off.
+            if resume_end_date is not None and resume_end_date > start_date:
+                end_date = min(resume_end_date, final_end_date)
+
+            self.state = incorporate(
+                self.state, bookmark_table, 'end_date', end_date)
+
+            pending_ids = [node_id for node_id in node_ids
+                           if node_id >= node_bookmark]
+
+            if activity is not None:
+                units = activity.plan(pending_ids, start_date, end_date)
+            else:
+                units = [(node_id, start_date) for node_id in pending_ids]
+
+            peak_rows = 0
+            window_started = time.time()
+            unit_started = time.perf_counter()
+            unit_start_dates = dict(units)
+
+            for node_id, parsed_response in self.fetch_reports(
+                    units, end_date):
+                rows = 0
+                output.start_report(table, start_date, end_date,
+                                    parsed_response['headers'])
+
+                # Rows are parsed as they're written, the parsing is timed
+                # on its own and isn't counted as output.
+                with singer.metrics.record_counter(endpoint=table) as ctr, \
+                        timing.timed('output', stream=table):
+                    for record in parsed_response['rows']:
+                        rows += 1
+
+                        if self.dedup is not None and \
+                           not self.dedup.is_new(
+                               bookmark_table, record, end_date):
+                            continue
+
+                        output.write_record(table, record)
+                        ctr.increment()
+
+                peak_rows = max(peak_rows, rows)
+
+                timing.record_unit(
+                    time.perf_counter() - unit_started, table, node_id,
+                    unit_start_dates.get(node_id), end_date)
+                unit_started = time.perf_counter()
+
+                if activity is not None:
+                    activity.record(node_id, rows, end_date)
+
+                # technician_id (or group_id) acts as a substream bookmark
+                # so that we can pick up in a single stream where we left
+                # off.
                 self.state = incorporate(
-                    self.state, table, 'technician_id', parent_id)
+                    self.state, bookmark_table, bookmark_key, node_id)
                 # There's no need to save `start_date` here. Even in the
                 # case of the first run the config start_date won't change
                 # so we're safe. It's acceptable to update start_date only
                 # after we're done the sync for this whole window.
-                save_state(self.state)
+                checkpointer.unit_done(self.state)
 
-            technician_id = 0
+            node_bookmark = 0
 
             self.state = incorporate(
-                self.state, table, 'start_date', end_date)
+                self.state, bookmark_table, 'start_date', end_date)
             # Because we go through all the technicians every time we sync
             # we need to start over by resetting the technician_id sub
             # bookmark to 0.
             self.state = incorporate(
-                self.state, table, 'technician_id', 0, force=True)
-            save_state(self.state)
+                self.state, bookmark_table, bookmark_key, 0, force=True)
+            checkpointer.save(self.state)
+
+            if end_date >= final_end_date:
+                break
+
+            self.window_sizer.observe(
+                peak_rows,
+                (time.time() - window_started) / max(len(units), 1))
+            start_date = end_date
+
+        if activity is not None:
+            activity.finish(final_end_date)
+            checkpointer.save(self.state)
+
+    def get_fetch_strategy(self):
+        strategy = self.config.get('report_fetch_strategy', 'technician')
+
+        if strategy not in FETCH_STRATEGIES:
+            raise Exception(
+                "Unknown report_fetch_strategy '{}', expected one of: {}"
+                .format(strategy, ', '.join(FETCH_STRATEGIES)))
+
+        return strategy
+
+    def get_report_nodes(self, parent_ids):
+        """Return the bookmark key and the node ids to request reports for
+        in each window."""
+        strategy = self.get_fetch_strategy()
+
+        if strategy == 'technician':
+            bookmark_key, node_ids = 'technician_id', parent_ids
+
+        elif self.hierarchy is None:
+            LOGGER.warning(
+                'No hierarchy available for %s, fetching reports per '
+                'technician instead of per %s.', self.TABLE, strategy)
+            bookmark_key, node_ids = 'technician_id', parent_ids
+
+        else:
+            bookmark_key, node_ids = 'group_id', \
+                self.hierarchy.report_nodes(strategy, parent_ids)
+
+        if self.shard is not None:
+            node_ids = self.shard.select(node_ids)
+
+        return bookmark_key, node_ids
+
+    def get_worker_count(self):
+        return max(int(self.config.get('report_workers', 1)), 1)
 
+    def log_fetch(self, node_id, index, total, start_date, end_date):
+        kind = 'technician'
+
+        if self.hierarchy is not None and \
+           not self.hierarchy.is_technician(node_id):
+            kind = 'node'
+
+        LOGGER.info(
+            'Fetching %s for %s %s (%s/%s) from %s to %s',
+            self.TABLE, kind, node_id, index + 1, total,
+            start_date, end_date)
+
+    def fetch_node(self, node_id, start_date, end_date, client=None):
+        """Fetch the report for a technician or, falling back to its
+        children, for a whole group. The fallback is only taken when the
+        group's report fails or has too many rows, other errors, e.g. rate
+        limits or failed logins, are raised."""
+        if self.hierarchy is None or self.hierarchy.is_technician(node_id):
+            return self.execute_request(
+                node_id, start_date, end_date, client=client)
+
+        max_rows = self.config.get('group_report_max_rows')
+
+        try:
+            parsed_response = self.execute_request(
+                node_id, start_date, end_date, client=client)
+
+            if max_rows is None:
+                return parsed_response
+
+            # At most `max_rows` rows are held, a report that reaches them
+            # is dropped without reading the rest of it.
+            max_rows = int(max_rows)
+            rows = parsed_response['rows']
+            first_rows = list(itertools.islice(rows, max_rows))
+
+            if len(first_rows) < max_rows:
+                parsed_response['rows'] = iter(first_rows)
+                return parsed_response
+
+            if hasattr(rows, 'close'):
+                rows.close()
+
+            reason = 'it has {} rows or more'.format(max_rows)
+
+        except ReportError as e:
+            reason = str(e)
+
+        children = self.hierarchy.report_children(node_id, self.parent_ids)
+
+        LOGGER.warning(
+            'Could not use the %s report for node %s (%s), fetching its '
+            '%s child nodes instead.', self.TABLE, node_id, reason,
+            len(children))
+
+        if not children:
+            return {'headers': [], 'rows': iter(())}
+
+        # The first child provides the headers, the others are only
+        # requested once the rows before them have been consumed.
+        first = self.fetch_node(
+            children[0], start_date, end_date, client=client)
+
+        def remaining_rows():
+            for child_id in children[1:]:
+                yield from self.fetch_node(
+                    child_id, start_date, end_date, client=client)['rows']
+
+        return {
+            'headers': first['headers'],
+            'rows': itertools.chain(first['rows'], remaining_rows()),
+        }
+
+    def fetch_node_window(self, node_id, start_date, end_date, client=None):
+        """Fetch the report for a node, splitting the window in two and
+        retrying each half when the report fails and the window can be
+        narrowed. Other errors, e.g. rate limits, are raised."""
+        try:
+            return self.fetch_node(
+                node_id, start_date, end_date, client=client)
+
+        except ReportError as e:
+            if not self.window_sizer.can_split(start_date, end_date):
+                raise
+
+            self.window_sizer.record_failure()
+            middle = self.window_sizer.split(start_date, end_date)
+
+            LOGGER.warning(
+                'Fetching %s for node %s from %s to %s failed (%s), '
+                'retrying as two windows split at %s.', self.TABLE,
+                node_id, start_date, end_date, e, middle)
+
+        first = self.fetch_node_window(
+            node_id, start_date, middle, client=client)
+
+        def remaining_rows():
+            yield from self.fetch_node_window(
+                node_id, middle, end_date, client=client)['rows']
+
+        return {
+            'headers': first['headers'],
+            'rows': itertools.chain(first['rows'], remaining_rows()),
+        }
+
+    def fetch_reports(self, units, end_date):
+        """Yield `(node_id, parsed_response)` for every `(node_id,
+        start_date)` in `units`, in order."""
+        workers = self.get_worker_count()
+
+        if workers > 1:
+            yield from self.fetch_reports_concurrently(
+                units, end_date, workers)
+            return
+
+        for index, (node_id, start_date) in enumerate(units):
+            self.log_fetch(node_id, index, len(units), start_date, end_date)
+
+            yield node_id, self.fetch_node_window(
+                node_id, start_date, end_date)
+
+    def fetch_reports_concurrently(self, units, end_date, workers):
+        """Fetch reports on `workers` threads, each with its own API
+        session, and yield them in the same order as `fetch_reports`.
+
+        Only a few units per worker are in flight at once so finished
+        reports don't pile up behind a slow one."""
+        pool = self.get_client_pool(workers)
+
+        def run(node_id, start_date):
+            with pool.checkout() as client, \
+                    timing.context(stream=self.TABLE):
+                parsed_response = self.fetch_node_window(
+                    node_id, start_date, end_date, client=client)
+
+                # Rows are parsed on the worker, while its client is
+                # checked out, and handed back in order.
+                parsed_response['rows'] = list(parsed_response['rows'])
+
+                return parsed_response
+
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                for index, (node_id, start_date) in enumerate(units):
+                    self.log_fetch(node_id, index, len(units),
+                                   start_date, end_date)
+
+                    pending.append((node_id, executor.submit(
+                        run, node_id, start_date)))
+
+                    if len(pending) >= workers * 2:
+                        node_id, future = pending.popleft()
+                        yield node_id, future.result()
+
+                while pending:
+                    node_id, future = pending.popleft()
+                    yield node_id, future.result()
+
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    def get_client_pool(self, workers):
+        # The pool outlives a single window so that its API sessions, and
+        # the report settings applied to them, carry over to the next one.
+        if self.client_pool is None:
+            self.client_pool = ClientPool(self.client, workers)
+
+        return self.client_pool
+
+    def close_client_pool(self):
+        if self.client_pool is not None:
+            self.client_pool.close()
+            self.client_pool = None
 
     def parse_data(self, data):
-        tree = ET.fromstring(data)
-        headers = tree.find('header')
+        """Parse a report into its converted header names and a generator
+        of transformed records.
 
-        to_return = {}
-        rows = []
+        `data` is the XML document, or an iterable of pieces of it."""
+        if isinstance(data, (str, bytes)):
+            data = [data]
 
-        for row in tree.findall('./data/row'):
-            to_add = {}
-            for field in row.findall('field'):
-                header_id = field.attrib['id']
-                attrib_finder = "field[@id='{}']".format(header_id)
-                header_text = headers.find(attrib_finder).text
-                to_add[header_text] = field.text
+        with timing.timed('parse', stream=self.TABLE):
+            reader = ReportReader(data)
 
-            rows.append(self.transform_record(to_add))
+        return {
+            'headers': [self.convert_key(header)
+                        for header in reader.headers.values()],
+            'rows': self.transform_rows(reader),
+        }
 
-        to_return['headers'] = [self.convert_key(e.text) for e in headers.findall('./field')]
-        to_return['rows'] = rows
-        return to_return
+    def transform_rows(self, reader):
+        transformer = self.get_row_transformer(reader.headers)
+
+        values = reader.values()
+
+        # Rows are parsed and transformed in batches, timing each row would
+        # cost a good share of the work itself.
+        try:
+            while True:
+                with timing.timed('parse', stream=self.TABLE):
+                    batch = list(itertools.islice(values, ROW_BATCH_SIZE))
+
+                if not batch:
+                    return
+
+                with timing.timed('transform', stream=self.TABLE):
+                    records = [transformer(row) for row in batch]
+
+                yield from records
+
+        # Rows that aren't wanted any more are never downloaded.
+        except GeneratorExit:
+            reader.close()
+            raise
@@ -1,8 +1,18 @@
 from tap_logmeinrescue.streams.base import BaseLogMeInRescueStream
 
 import singer
+from concurrent.futures import ThreadPoolExecutor
 
+from tap_logmeinrescue import output, timing
+from tap_logmeinrescue.dedup import DedupIndex
+from tap_logmeinrescue.hierarchy import Hierarchy, TECHNICIAN, \
+    iter_lines, parse_nodes
 from tap_logmeinrescue.logger import LOGGER
+from tap_logmeinrescue.report_cache import HIERARCHY, ReportCache
+from tap_logmeinrescue.sharding import Shard, seed_bookmarks
+from tap_logmeinrescue.snapshot import HierarchySnapshot, fingerprint
+from tap_logmeinrescue.state import save_state
+from tap_logmeinrescue.sweep import SWEEP_MODES, CombinedSweep
 
 
 class TechniciansStream(BaseLogMeInRescueStream):
@@ -10,47 +20,117 @@ class TechniciansStream(BaseLogMeInRescueStream):
     KEY_PROPERTIES = ['nodeid']
     API_METHOD = 'GET'
 
+    hierarchy = None
+
     def get_url(self):
-        return 'https://secure.logmeinrescue.com/API/getHierarchy_v2.aspx'
+        return self.client.get_url('getHierarchy_v2')
+
+    def get_stream_data(self, chunks):
+        """Parse the hierarchy in a single pass over the response, yielding
+        each technician as it's read.
+
+        Groups are kept in the hierarchy so that reports can be requested
+        for a whole group at once, see `report_fetch_strategy`."""
+        self.hierarchy = Hierarchy()
+        keys = {}
+
+        for node in parse_nodes(iter_lines(chunks)):
+            converted = {}
+
+            for key, value in node.items():
+                if key not in keys:
+                    keys[key] = self.convert_key(key)
+
+                converted[keys[key]] = value
+
+            if not self.hierarchy.add(converted) or \
+               converted.get('type') != TECHNICIAN:
+                continue
+
+            transformer = self.get_row_transformer(
+                {key: key for key in node})
+
+            yield transformer(node)
+
+    def get_changed_technicians(self, technicians):
+        """Return the technicians that are new or changed since the last
+        snapshot, plus a record for each one that was removed, and what's
+        needed to save the new snapshot once they've been written."""
+        now = singer.utils.now()
+        bookmarks = self.state.setdefault('bookmarks', {}) \
+                              .setdefault(self.get_bookmark_table(), {})
+        snapshot = HierarchySnapshot.from_config(self.config, self.shard)
+        previous = snapshot.load(bookmarks, now)
 
-    def get_stream_data(self, response):
-        to_return = []
-        nodes = response.split('\n\n')[1:-1]
+        nodes = {str(technician['nodeid']): fingerprint(technician)
+                 for technician in technicians}
 
-        for node in nodes:
-            item = {}
-            fields = node.split('\n')
+        if previous is None:
+            bookmarks['full_refresh_at'] = singer.utils.strftime(now)
+            return technicians, (snapshot, nodes)
 
-            for field in fields:
-                (k, v) = field.split(':')
-                item[k] = v
+        changed = [technician for technician in technicians
+                   if previous.get(str(technician['nodeid'])) !=
+                   nodes[str(technician['nodeid'])]]
+        removed = [{'nodeid': int(node_id),
+                    '_sdc_deleted_at': singer.utils.strftime(now)}
+                   for node_id in sorted(previous, key=int)
+                   if node_id not in nodes]
 
-            output = self.transform_record(item)
+        LOGGER.info('%s of %s technicians are new or changed, %s were '
+                    'removed.', len(changed), len(technicians), len(removed))
 
-            if output.get('type') == 'Technician':
-                to_return.append(output)
+        return changed + removed, (snapshot, nodes)
 
-        return to_return
+    def save_snapshot(self, snapshot, nodes):
+        digest = snapshot.save(nodes)
+        bookmarks = self.state['bookmarks'][self.get_bookmark_table()]
+
+        if digest is None:
+            # Without a snapshot, the next sync has to emit everything.
+            bookmarks.pop('snapshot_digest', None)
+        else:
+            bookmarks['snapshot_digest'] = digest
+
+        save_state(self.state)
 
     def sync_data(self, return_ids=False):
         table = self.TABLE
 
-        response = self.client.make_request(self.get_url(), 'GET')
+        report_cache = ReportCache.from_config(self.config)
+
+        with timing.context(stream=table):
+            chunks = self.request_hierarchy(report_cache)
 
-        # In development, the fastest way to decrease iteration time is to
-        # slice the following data down to something very small like 10.
-        #
-        # all_technicians = self.get_stream_data(response)[:10]
-        all_technicians = self.get_stream_data(response)
+            # In development, the fastest way to decrease iteration time is
+            # to slice the following data down to something very small
+            # like 10.
+            #
+            # all_technicians = list(itertools.islice(
+            #     self.get_stream_data(chunks), 10))
+            with timing.timed('parse', stream=table):
+                all_technicians = list(self.get_stream_data(chunks))
 
         if not return_ids:
-            with singer.metrics.record_counter(endpoint=table) as counter:
-                for obj in all_technicians:
-                    singer.write_records(
-                        table,
-                        [obj])
+            self.shard = Shard.from_config(self.config)
+            records = all_technicians
+            snapshot = None
+
+            if self.shard is not None:
+                LOGGER.info('Syncing %s.', self.shard.name)
+                records = [technician for technician in all_technicians
+                           if self.shard.owns(technician['nodeid'])]
+
+            if self.config.get('hierarchy_incremental'):
+                records, snapshot = self.get_changed_technicians(records)
 
-                    counter.increment()
+            with singer.metrics.record_counter(endpoint=table) as counter, \
+                    timing.timed('output', stream=table):
+                output.write_records(table, records)
+                counter.increment(len(records))
+
+            if snapshot is not None:
+                self.save_snapshot(*snapshot)
 
         technician_ids = sorted(
             [technician.get('nodeid')
@@ -59,9 +139,110 @@ class TechniciansStream(BaseLogMeInRescueStream):
         if return_ids:
             return technician_ids
 
+        for substream in self.substreams:
+            if self.shard is not None:
+                seed_bookmarks(self.state, substream.TABLE, self.shard)
+
+        dedup = DedupIndex.from_config(self.config, self.shard)
+
+        if dedup is not None:
+            dedup.load(self.state)
+
         for substream in self.substreams:
             substream.state = self.state
+            substream.hierarchy = self.hierarchy
+            substream.report_cache = report_cache
+            substream.shard = self.shard
+            substream.dedup = dedup
+
+        try:
+            self.sync_substreams(technician_ids)
+        finally:
+            if report_cache is not None:
+                report_cache.log_stats()
+
+            if dedup is not None:
+                dedup.save()
+                dedup.log_stats()
+
+    def request_hierarchy(self, report_cache=None):
+        """Return an iterator over the body of the hierarchy, read from the
+        report cache when it's replaying."""
+        if report_cache is not None and report_cache.replay:
+            chunks = report_cache.get(HIERARCHY)
+
+            if chunks is None:
+                raise Exception('The report cache in {} holds no hierarchy '
+                                'to replay.'.format(report_cache.directory))
+
+            return chunks
+
+        status, chunks = self.client.stream_request(self.get_url(), 'GET')
+
+        if status != 'OK':
+            raise Exception(
+                'Error with getHierarchy_v2 request: {}'.format(status))
+
+        if report_cache is not None:
+            return report_cache.record(HIERARCHY, chunks)
+
+        return chunks
+
+    def sync_substreams(self, technician_ids):
+        sweep = self.config.get('report_sweep', 'stream')
+
+        if sweep not in SWEEP_MODES:
+            raise Exception(
+                "Unknown report_sweep '{}', expected one of: {}"
+                .format(sweep, ', '.join(SWEEP_MODES)))
+
+        if sweep == 'combined' and len(self.substreams) > 1:
+            LOGGER.info('Syncing {} in a combined sweep'.format(
+                ', '.join(substream.TABLE for substream in self.substreams)))
+
+            ignored = [key for key in ('report_workers',
+                                       'report_stream_workers')
+                       if int(self.config.get(key, 1)) > 1]
+
+            if ignored:
+                LOGGER.warning('The combined sweep ignores {}.'.format(
+                    ', '.join(ignored)))
+
+            sweeper = CombinedSweep.from_config(
+                self.substreams, self.client, self.config)
+            self.state = sweeper.sync(technician_ids, self.state)
+            return
+
+        workers = min(int(self.config.get('report_stream_workers', 1)),
+                      len(self.substreams))
+
+        if workers > 1:
+            self.sync_substreams_concurrently(technician_ids, workers)
+            return
+
+        for substream in self.substreams:
             LOGGER.info("Syncing {}".format(substream.TABLE))
             substream.sync_data(
                 parent_ids=technician_ids)
             self.state = substream.state
+
+    def sync_substreams_concurrently(self, technician_ids, workers):
+        """Sync the report streams at the same time, each with an API
+        session of its own. They share the state, in which each one only
+        updates its own bookmarks, and the output."""
+        def run(substream):
+            substream.client = self.client.spawn()
+
+            try:
+                LOGGER.info("Syncing {}".format(substream.TABLE))
+                substream.sync_data(parent_ids=technician_ids)
+            finally:
+                substream.client.close()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run, substream)
+                       for substream in self.substreams]
+
+            # Raises the first failure, once every stream has finished.
+            for future in futures:
+                future.result()
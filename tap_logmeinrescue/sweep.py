@@ -0,0 +1,240 @@
+import time
+
+import singer
+from dateutil.parser import parse
+
+from tap_framework.config import get_config_start_date
+from tap_logmeinrescue import output, timing
+from tap_logmeinrescue.activity import ActivityIndex
+from tap_logmeinrescue.logger import LOGGER
+from tap_logmeinrescue.state import Checkpointer, \
+    get_last_record_value_for_table, incorporate
+from tap_logmeinrescue.windows import DateWindowSizer
+
+SWEEP_MODES = ('stream', 'combined')
+
+
+class StreamProgress:
+    """Where a stream's bookmarks say its sync is at."""
+
+    def __init__(self, stream, bookmark_key, config, activity=None):
+        state = stream.state
+        table = stream.get_bookmark_table()
+
+        start_date = get_last_record_value_for_table(
+            state, table, 'start_date')
+        resume_end_date = get_last_record_value_for_table(
+            state, table, 'end_date')
+
+        self.start_date = parse(start_date) if start_date \
+            else get_config_start_date(config)
+        self.resume_end_date = parse(resume_end_date) if resume_end_date \
+            else None
+        self.node_bookmark = get_last_record_value_for_table(
+            state, table, bookmark_key) or 0
+        self.activity = activity
+
+    def skips(self, node_id, end_date):
+        """Whether `node_id` was already synced through `end_date` by an
+        interrupted sync."""
+        return self.resume_end_date is not None and \
+            end_date <= self.resume_end_date and \
+            node_id < self.node_bookmark
+
+    def plan(self, node_ids, start_date, end_date):
+        """Return `(node_id, start_date)` for each of `node_ids` to fetch
+        in the window ending at `end_date`. With an activity index,
+        technicians an earlier run left behind start where they were
+        synced through, and dormant ones may be skipped."""
+        pending = [node_id for node_id in node_ids
+                   if not self.skips(node_id, end_date)]
+
+        if self.activity is None:
+            return [(node_id, start_date) for node_id in pending]
+
+        return self.activity.plan(pending, start_date, end_date)
+
+
+class CombinedSweep:
+    """Syncs several report streams in a single pass over the date windows
+    and the technicians (or groups), instead of one stream after another.
+
+    Every window is shared by all the streams. Within a window, each block
+    of `block_size` nodes is requested for every stream in turn, going
+    through the streams backwards every other block, so the report area
+    changes once per stream and block. The client is told to keep the
+    timezone, dates and output per API session instead of per area while
+    it sweeps, so the dates are only sent once per window. Each stream keeps its own bookmarks, in the same form
+    as a separate sweep.
+
+    The streams share the sync's API session: `report_workers` and
+    `report_stream_workers` don't apply. The activity index is kept per
+    stream, as with separate sweeps."""
+
+    def __init__(self, streams, client, config, block_size=None):
+        self.streams = streams
+        self.client = client
+        self.config = config
+        self.block_size = block_size
+
+    @classmethod
+    def from_config(cls, streams, client, config):
+        block_size = config.get('sweep_block_size')
+
+        return cls(streams, client, config,
+                   int(block_size) if block_size else None)
+
+    def sync(self, parent_ids, state):
+        """Sync every stream for `parent_ids`, returning the state."""
+        self.client.share_report_settings = True
+
+        try:
+            return self.sync_windows(parent_ids, state)
+        finally:
+            self.client.share_report_settings = False
+
+    def sync_windows(self, parent_ids, state):
+        streams = self.streams
+        bookmark_key, node_ids = streams[0].get_report_nodes(parent_ids)
+        block_size = self.block_size or max(len(node_ids), 1)
+
+        sizer = DateWindowSizer.from_config(self.config)
+        checkpointer = Checkpointer.from_config(self.config)
+        final_end_date = min(stream.get_final_end_date()
+                             for stream in streams)
+        progress = {}
+        activities = {}
+
+        for stream in streams:
+            stream.state = state
+            stream.parent_ids = parent_ids
+            stream.window_sizer = sizer
+            stream.write_schema()
+
+            # As with a separate sweep, an index left in the state by an
+            # earlier run is honoured even when `activity_index` is off.
+            if bookmark_key == 'technician_id':
+                activities[stream.TABLE] = ActivityIndex.from_state(
+                    state, stream.get_bookmark_table(), self.config,
+                    stream.hierarchy, now=final_end_date)
+
+            progress[stream.TABLE] = StreamProgress(
+                stream, bookmark_key, self.config,
+                activities.get(stream.TABLE))
+
+        start_date = min(item.start_date for item in progress.values())
+        reverse = False
+
+        if start_date >= final_end_date:
+            LOGGER.info('Nothing to sync before %s.', final_end_date)
+            return state
+
+        while True:
+            end_date = sizer.next_end_date(start_date, final_end_date)
+
+            # Finish an interrupted window with the end date it had.
+            resume_end_dates = [
+                item.resume_end_date for item in progress.values()
+                if item.start_date == start_date and
+                item.resume_end_date is not None and
+                item.resume_end_date > start_date]
+
+            if resume_end_dates:
+                end_date = min(resume_end_dates)
+
+            active = [stream for stream in streams
+                      if progress[stream.TABLE].start_date < end_date]
+
+            for stream in active:
+                # Forced, an interrupted window may have ended later.
+                incorporate(state, stream.get_bookmark_table(), 'end_date',
+                            end_date, force=True)
+
+            peak_rows = 0
+            window_started = time.time()
+            units = 0
+
+            for offset in range(0, len(node_ids), block_size):
+                block = node_ids[offset:offset + block_size]
+
+                # Every other block goes through the streams backwards, so
+                # the area of the last stream carries over to the next one.
+                ordered = active[::-1] if reverse else active
+                reverse = not reverse
+
+                for stream in ordered:
+                    item = progress[stream.TABLE]
+
+                    for node_id, unit_start in item.plan(
+                            block, max(start_date, item.start_date),
+                            end_date):
+                        rows = self.sync_unit(
+                            stream, node_id, unit_start, end_date)
+                        peak_rows = max(peak_rows, rows)
+                        units += 1
+
+                        if item.activity is not None:
+                            item.activity.record(node_id, rows, end_date)
+
+                        incorporate(state, stream.get_bookmark_table(),
+                                    bookmark_key, node_id)
+                        checkpointer.unit_done(state)
+
+            for stream in active:
+                bookmark_table = stream.get_bookmark_table()
+                incorporate(state, bookmark_table, 'start_date', end_date)
+                incorporate(state, bookmark_table, bookmark_key, 0,
+                            force=True)
+                progress[stream.TABLE] = StreamProgress(
+                    stream, bookmark_key, self.config,
+                    activities.get(stream.TABLE))
+
+            checkpointer.save(state)
+
+            if end_date >= final_end_date:
+                break
+
+            sizer.observe(peak_rows,
+                          (time.time() - window_started) / max(units, 1))
+            start_date = end_date
+
+        for activity in activities.values():
+            if activity is not None:
+                activity.finish(final_end_date)
+
+        checkpointer.save(state)
+
+        return state
+
+    def sync_unit(self, stream, node_id, start_date, end_date):
+        table = stream.TABLE
+        bookmark_table = stream.get_bookmark_table()
+        started = time.perf_counter()
+        rows = 0
+
+        LOGGER.info('Fetching %s for node %s from %s to %s',
+                    table, node_id, start_date, end_date)
+
+        with timing.context(stream=table):
+            parsed_response = stream.fetch_node_window(
+                node_id, start_date, end_date, client=self.client)
+            output.start_report(table, start_date, end_date,
+                                parsed_response['headers'])
+
+            with singer.metrics.record_counter(endpoint=table) as counter, \
+                    timing.timed('output', stream=table):
+                for record in parsed_response['rows']:
+                    rows += 1
+
+                    if stream.dedup is not None and \
+                       not stream.dedup.is_new(
+                           bookmark_table, record, end_date):
+                        continue
+
+                    output.write_record(table, record)
+                    counter.increment()
+
+        timing.record_unit(time.perf_counter() - started, table, node_id,
+                           start_date, end_date)
+
+        return rows
@@ -0,0 +1,261 @@
+import bisect
+import collections
+import contextlib
+import heapq
+import json
+import os
+import tempfile
+import threading
+import time
+
+from tap_logmeinrescue.logger import LOGGER
+from tap_logmeinrescue.snapshot import fingerprint
+
+# Upper bounds of the histogram buckets, in seconds.
+BUCKETS = (0.001, 0.01, 0.1, 1, 10, float('inf'))
+BUCKET_LABELS = ('<1ms', '<10ms', '<100ms', '<1s', '<10s', '>=10s')
+
+DEFAULT_SLOWEST_UNITS = 10
+
+
+class PhaseStats:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def histogram(self):
+        return ' '.join('{}:{}'.format(label, count)
+                        for label, count in zip(BUCKET_LABELS, self.buckets)
+                        if count)
+
+
+class Timings:
+    """Where the time of a run goes, by phase.
+
+    Phases are timed with `timed()` and are exclusive: time spent in a
+    phase nested in another, e.g. downloading a report while it's parsed,
+    is only counted for the inner one. Each sample is tagged with the
+    stream and endpoint it's for, taken from the arguments or from the
+    thread's `context()`. Safe to share between threads."""
+
+    def __init__(self, slowest_units=DEFAULT_SLOWEST_UNITS):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.perf_counter()
+        self.phases = collections.defaultdict(PhaseStats)
+        self.slowest_units = slowest_units
+        self.units = []
+        self.unit_stats = collections.defaultdict(PhaseStats)
+
+    def get_stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+            self.local.tags = {}
+
+        return self.local.stack
+
+    @contextlib.contextmanager
+    def context(self, **tags):
+        """Tag every phase timed on this thread within the block."""
+        self.get_stack()
+        previous = self.local.tags
+        self.local.tags = dict(previous, **tags)
+
+        try:
+            yield
+        finally:
+            self.local.tags = previous
+
+    @contextlib.contextmanager
+    def timed(self, phase, **tags):
+        stack = self.get_stack()
+        # The second item collects the time of the phases nested in this one.
+        frame = [time.perf_counter(), 0.0]
+        stack.append(frame)
+
+        try:
+            yield
+        finally:
+            stack.pop()
+            elapsed = time.perf_counter() - frame[0]
+
+            if stack:
+                stack[-1][1] += elapsed
+
+            self.record(phase, elapsed - frame[1], **tags)
+
+    def timed_iter(self, iterable, phase, **tags):
+        """Yield from `iterable`, timing the production of each item."""
+        iterator = iter(iterable)
+
+        while True:
+            with self.timed(phase, **tags):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+
+            yield item
+
+    def record(self, phase, seconds, **tags):
+        tags = dict(self.local.tags, **tags) \
+            if hasattr(self.local, 'tags') else tags
+        keys = [(phase,)]
+
+        for name in ('stream', 'endpoint'):
+            if tags.get(name) is not None:
+                keys.append((phase, name, tags[name]))
+
+        with self.lock:
+            for key in keys:
+                self.phases[key].add(seconds)
+
+    def record_unit(self, seconds, stream, node_id, start_date, end_date):
+        """Keep track of how long a unit of work, one node over one window,
+        took, so the slowest ones can be listed at the end."""
+        unit = (seconds, stream, node_id, str(start_date), str(end_date))
+
+        with self.lock:
+            self.unit_stats[stream].add(seconds)
+
+            if len(self.units) < self.slowest_units:
+                heapq.heappush(self.units, unit)
+            else:
+                heapq.heappushpop(self.units, unit)
+
+    def history(self):
+        """Return the mean seconds per request of each endpoint, the time to
+        download the response included, and per unit of each stream."""
+        with self.lock:
+            endpoints = {}
+
+            for key, stats in self.phases.items():
+                if key[0] == 'request' and key[1:2] == ('endpoint',):
+                    download = self.phases.get(('download',) + key[1:])
+                    total = stats.total + (download.total if download else 0)
+                    endpoints[key[2]] = {'count': stats.count,
+                                         'mean': total / stats.count}
+
+            units = {stream: {'count': stats.count,
+                              'mean': stats.total / stats.count}
+                     for stream, stats in self.unit_stats.items()
+                     if stats.count}
+
+        return {'endpoints': endpoints, 'units': units}
+
+    def log_summary(self):
+        with self.lock:
+            elapsed = time.perf_counter() - self.started
+            phases = sorted(self.phases.items(),
+                            key=lambda item: (item[0][0], -item[1].total))
+            units = sorted(self.units, reverse=True)
+
+        LOGGER.info('Time by phase, %.1fs in total:', elapsed)
+
+        for key, stats in phases:
+            if len(key) == 1:
+                label = key[0]
+            else:
+                label = '  {} {}={}'.format(*key)
+
+            LOGGER.info(
+                '%-48s %8.2fs %7s calls, mean %.4fs, max %.4fs  %s',
+                label[:48], stats.total, stats.count,
+                stats.total / max(stats.count, 1), stats.maximum,
+                stats.histogram())
+
+        if units:
+            LOGGER.info('Slowest units:')
+
+        for seconds, stream, node_id, start_date, end_date in units:
+            LOGGER.info('  %.2fs %s node %s from %s to %s',
+                        seconds, stream, node_id, start_date, end_date)
+
+
+def history_path(config):
+    path = config.get('timing_history_path')
+
+    if path is None:
+        path = os.path.join(
+            tempfile.gettempdir(),
+            'tap-logmeinrescue-timings-{}.json'.format(
+                fingerprint(config.get('username'))))
+
+    return path
+
+
+def load_history(path):
+    """Return the latencies recorded by earlier syncs, see `save_history`."""
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except (IOError, OSError, ValueError):
+        return {'endpoints': {}, 'units': {}}
+
+
+def save_history(path):
+    """Record the latencies of this sync over those of earlier ones, for
+    the estimates of a dry run."""
+    history = load_history(path)
+    recorded = TIMINGS.history()
+
+    for section in ('endpoints', 'units'):
+        history.setdefault(section, {}).update(recorded[section])
+
+    try:
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile(
+                'w', dir=directory, delete=False) as handle:
+            json.dump(history, handle, indent=2, sort_keys=True)
+
+        os.replace(handle.name, path)
+
+    except (IOError, OSError) as e:
+        LOGGER.warning('Could not write the timing history to %s: %s',
+                       path, e)
+
+
+TIMINGS = Timings()
+
+
+def reset():
+    global TIMINGS
+
+    TIMINGS = Timings()
+
+    return TIMINGS
+
+
+def context(**tags):
+    return TIMINGS.context(**tags)
+
+
+def timed(phase, **tags):
+    return TIMINGS.timed(phase, **tags)
+
+
+def timed_iter(iterable, phase, **tags):
+    return TIMINGS.timed_iter(iterable, phase, **tags)
+
+
+def record(phase, seconds, **tags):
+    TIMINGS.record(phase, seconds, **tags)
+
+
+def record_unit(seconds, stream, node_id, start_date, end_date):
+    TIMINGS.record_unit(seconds, stream, node_id, start_date, end_date)
+
+
+def log_summary():
+    TIMINGS.log_summary()
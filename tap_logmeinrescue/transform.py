@@ -0,0 +1,190 @@
+import singer
+from singer.transform import Error, SchemaMismatch, Transformer, \
+    string_to_datetime
+
+from tap_logmeinrescue.logger import LOGGER
+
+
+def coerce_null(value):
+    if value is None or value == '':
+        return True, None
+
+    return False, None
+
+
+def coerce_datetime(value):
+    if value is None or value == '':
+        return False, None
+
+    value = string_to_datetime(value)
+
+    return value is not None, value
+
+
+def coerce_string(value):
+    if value is None:
+        return False, None
+
+    return True, str(value)
+
+
+def coerce_integer(value):
+    if isinstance(value, str):
+        value = value.replace(',', '')
+
+    try:
+        return True, int(value)
+    except (TypeError, ValueError):
+        return False, None
+
+
+def coerce_number(value):
+    if isinstance(value, str):
+        value = value.replace(',', '')
+
+    try:
+        return True, float(value)
+    except (TypeError, ValueError):
+        return False, None
+
+
+def coerce_boolean(value):
+    if isinstance(value, str) and value.lower() == 'false':
+        return True, False
+
+    return True, bool(value)
+
+
+COERCERS = {
+    'string': coerce_string,
+    'integer': coerce_integer,
+    'number': coerce_number,
+    'boolean': coerce_boolean,
+}
+
+
+def compile_coercer(schema):
+    """Return a function of a value to `(success, value)` that coerces it
+    the way `singer.Transformer` would for `schema`.
+
+    Report values are flat strings, so only scalar types are compiled.
+    Anything else is handed to a `Transformer`."""
+    types = schema.get('type')
+
+    if 'anyOf' in schema or types is None:
+        return None
+
+    if not isinstance(types, list):
+        types = [types]
+
+    # Like the Transformer, null is always tried last.
+    types = [typ for typ in types if typ != 'null'] + \
+        [typ for typ in types if typ == 'null']
+
+    steps = []
+
+    for typ in types:
+        if typ == 'null':
+            steps.append(coerce_null)
+        elif schema.get('format') == 'date-time':
+            steps.append(coerce_datetime)
+        elif typ in COERCERS:
+            steps.append(COERCERS[typ])
+        else:
+            return None
+
+    if len(steps) == 1:
+        return steps[0]
+
+    def coerce(value):
+        for step in steps:
+            success, result = step(value)
+
+            if success:
+                return success, result
+
+        return False, None
+
+    return coerce
+
+
+class RowTransformer:
+    """Turns report rows into records for one report layout.
+
+    Built once from a report's `{field id: header text}` map, it maps each
+    field id straight to its column name and a coercer compiled from the
+    column's schema. Columns that aren't in the schema, aren't selected or
+    are unsupported are dropped up front, so each row is a single pass over
+    its values. The result is the same as `transform_record` on the row."""
+
+    def __init__(self, headers, schema, metadata, convert_key):
+        properties = schema.get('properties', {})
+        metadata = metadata or {}
+
+        self.columns = {}
+        removed = []
+        filtered = []
+
+        for field_id, header in headers.items():
+            column = convert_key(header)
+
+            if self.is_filtered(metadata, column):
+                filtered.append(column)
+                continue
+
+            if column not in properties:
+                removed.append(column)
+                continue
+
+            self.columns[field_id] = (
+                column,
+                properties[column],
+                compile_coercer(properties[column]))
+
+        if filtered:
+            LOGGER.info('Filtered %s columns as they were unsupported or '
+                        'not selected: %s', len(filtered), sorted(filtered))
+
+        if removed:
+            LOGGER.warning('Removed %s columns not in the schema: %s',
+                           len(removed), sorted(removed))
+
+    @staticmethod
+    def is_filtered(metadata, column):
+        breadcrumb = ('properties', column)
+        inclusion = singer.metadata.get(metadata, breadcrumb, 'inclusion')
+
+        if inclusion == 'automatic':
+            return False
+
+        return inclusion == 'unsupported' or \
+            singer.metadata.get(metadata, breadcrumb, 'selected') is False
+
+    def __call__(self, values):
+        """Transform `values`, a row's `{field id: text}` map."""
+        record = {}
+        columns = self.columns
+
+        for field_id, value in values.items():
+            column = columns.get(field_id)
+
+            if column is None:
+                continue
+
+            name, schema, coerce = column
+
+            if coerce is None:
+                success, result = self.transform_fallback(value, schema, name)
+            else:
+                success, result = coerce(value)
+
+            if not success:
+                raise SchemaMismatch([Error([name], value, schema)])
+
+            record[name] = result
+
+        return record
+
+    @staticmethod
+    def transform_fallback(value, schema, name):
+        return Transformer().transform_recur(value, schema, [name])
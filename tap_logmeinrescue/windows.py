@@ -0,0 +1,90 @@
+import threading
+from datetime import timedelta
+
+from tap_logmeinrescue.logger import LOGGER
+
+DEFAULT_WINDOW_DAYS = 7
+DEFAULT_TARGET_ROWS = 1000
+DEFAULT_TARGET_SECONDS = 30
+
+
+def days_to_delta(days):
+    # The API only takes dates down to the second.
+    return timedelta(seconds=int(float(days) * 24 * 60 * 60))
+
+
+class DateWindowSizer:
+    """Chooses the length of each report date window from how the previous
+    window went.
+
+    A window is widened when its largest report was small and quick, and
+    narrowed when a report was large, slow or failed. With the defaults
+    (min, max and initial all 7 days) every window is 7 days long."""
+
+    def __init__(self, initial_days=DEFAULT_WINDOW_DAYS, min_days=None,
+                 max_days=None, target_rows=DEFAULT_TARGET_ROWS,
+                 target_seconds=DEFAULT_TARGET_SECONDS):
+        self.size = days_to_delta(initial_days)
+        self.min_size = days_to_delta(
+            min_days if min_days is not None else initial_days)
+        self.max_size = days_to_delta(
+            max_days if max_days is not None else initial_days)
+        self.target_rows = target_rows
+        self.target_seconds = target_seconds
+
+        self.size = min(max(self.size, self.min_size), self.max_size)
+        self.lock = threading.Lock()
+        self.failures = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            initial_days=config.get('window_initial_days',
+                                    DEFAULT_WINDOW_DAYS),
+            min_days=config.get('window_min_days'),
+            max_days=config.get('window_max_days'),
+            target_rows=int(config.get('window_target_rows',
+                                       DEFAULT_TARGET_ROWS)),
+            target_seconds=float(config.get('window_target_seconds',
+                                            DEFAULT_TARGET_SECONDS)))
+
+    def next_end_date(self, start_date, final_end_date):
+        return min(start_date + self.size, final_end_date)
+
+    def can_split(self, start_date, end_date):
+        return end_date - start_date >= 2 * self.min_size
+
+    def split(self, start_date, end_date):
+        """Return the middle of a window, to the second."""
+        half = int((end_date - start_date).total_seconds()) // 2
+        return start_date + timedelta(seconds=half)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+
+    def observe(self, peak_rows, seconds_per_request):
+        """Resize the next window given the largest report row count and
+        the average time per report of the window that just finished."""
+        with self.lock:
+            failures = self.failures
+            self.failures = 0
+
+        previous = self.size
+
+        if failures or peak_rows > self.target_rows or \
+           seconds_per_request > self.target_seconds:
+            self.size = max(self.size / 2, self.min_size)
+
+        elif peak_rows * 4 <= self.target_rows and \
+                seconds_per_request * 4 <= self.target_seconds:
+            self.size = min(self.size * 2, self.max_size)
+
+        self.size = timedelta(seconds=int(self.size.total_seconds()))
+
+        if self.size != previous:
+            LOGGER.info(
+                'Resizing report window from %s to %s (peak rows: %s, '
+                'seconds per report: %.2f, failures: %s)',
+                previous, self.size, peak_rows, seconds_per_request,
+                failures)
@@ -0,0 +1,122 @@
+"""Run the tap in process against the benchmark API simulator."""
+import argparse
+import collections
+import contextlib
+import datetime
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+from unittest import mock
+
+import pytz
+from singer.catalog import Catalog
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+
+import simulator  # noqa: E402
+
+import tap_logmeinrescue  # noqa: E402
+from tap_logmeinrescue.client import LogMeInRescueClient  # noqa: E402
+from tap_logmeinrescue.streams import AVAILABLE_STREAMS  # noqa: E402
+
+SETTINGS_CALLS = ('setReportArea_v8', 'setTimezone', 'setReportDate_v2',
+                  'setOutput')
+
+
+def select_all(catalog):
+    for stream in catalog['streams']:
+        for mdata in stream['metadata']:
+            if mdata['breadcrumb'] == []:
+                mdata['metadata']['selected'] = True
+
+    return catalog
+
+
+class SimulatedTap:
+    """A simulated account and a tap configured to sync it, from `days`
+    days back. The catalog selects every stream. The tap's clock is
+    stopped at midnight, so the windows of every run are the same."""
+
+    def __init__(self, test, days=21, config=None, **simulation):
+        self.simulation = simulator.Simulation(**simulation)
+        server = simulator.start(self.simulation)
+        test.addCleanup(server.shutdown)
+
+        self.directory = tempfile.mkdtemp()
+        test.addCleanup(shutil.rmtree, self.directory, True)
+
+        self.now = pytz.utc.localize(datetime.datetime.utcnow().replace(
+            hour=0, minute=0, second=0, microsecond=0))
+        start_date = self.now - datetime.timedelta(days=days)
+
+        self.config = {
+            'username': 'test@example.com',
+            'password': 'test',
+            'start_date': start_date.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'api_base_url': simulator.base_url(server),
+            'retry_base_seconds': 0,
+            'timing_history_path': self.path('timings.json'),
+        }
+        self.config.update(config or {})
+        self.catalog = None
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def run(self, method, state=None, config=None):
+        """Call `method` of a runner, returning what it wrote to stdout."""
+        config = dict(self.config, **(config or {}))
+        args = argparse.Namespace(config=config, state=state or {},
+                                  catalog=self.catalog)
+        client = LogMeInRescueClient(config)
+        runner = tap_logmeinrescue.LogMeInRescueRunner(
+            args, client, AVAILABLE_STREAMS)
+        stdout = io.StringIO()
+
+        try:
+            with contextlib.redirect_stdout(stdout), \
+                    mock.patch('singer.utils.now', return_value=self.now):
+                getattr(runner, method)()
+                tap_logmeinrescue.output.WRITER.flush()
+        finally:
+            client.close()
+
+        return stdout.getvalue()
+
+    def discover(self):
+        if self.catalog is None:
+            catalog = json.loads(self.run('do_discover'))
+            self.catalog = Catalog.from_dict(select_all(catalog))
+
+        return self.catalog
+
+    def sync(self, state=None, config=None):
+        """Sync, returning the messages written and the API calls made."""
+        self.discover()
+        self.simulation.calls.clear()
+
+        output = self.run('do_sync', state, config)
+        messages = [json.loads(line) for line in output.splitlines()]
+
+        return messages, collections.Counter(self.simulation.calls)
+
+    def plan(self, state=None, config=None):
+        self.discover()
+
+        return json.loads(self.run('do_plan', state, config))
+
+
+def records(messages, stream=None):
+    return [message['record'] for message in messages
+            if message['type'] == 'RECORD' and
+            (stream is None or message['stream'] == stream)]
+
+
+def last_state(messages):
+    states = [message['value'] for message in messages
+              if message['type'] == 'STATE']
+
+    return states[-1] if states else None
@@ -0,0 +1,97 @@
+import datetime
+import unittest
+
+from dateutil.parser import parse
+
+from simulated import SimulatedTap, last_state, records
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+TABLE = 'session_report'
+REPORT_STREAMS = ('session_report', 'technician_survey_report',
+                  'transferred_sessions_extended_report')
+
+
+def keep_quiet(simulation, quiet):
+    """Return no rows for the technicians in `quiet`."""
+    technicians_under = simulation.technicians_under
+
+    def active_technicians_under(node_id):
+        technician_ids = technicians_under(node_id)
+
+        if technician_ids is None:
+            return None
+
+        return [technician_id for technician_id in technician_ids
+                if technician_id not in quiet]
+
+    simulation.technicians_under = active_technicians_under
+
+
+class TestActivityIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tap = SimulatedTap(self, technicians=3, days=21, config={
+            'activity_index': True,
+            'dormant_after_windows': 2,
+            'dormant_probe_days': 10,
+        })
+        self.quiet = {1000}
+        keep_quiet(self.tap.simulation, self.quiet)
+
+    def test_dormant_technicians_are_skipped(self):
+        messages, calls = self.tap.sync()
+
+        # Technician 1000 is dormant after 2 empty windows, and is skipped
+        # in the third.
+        self.assertEqual(calls['getReport_v2'], 3 * (3 * 3 - 1))
+
+        activity = last_state(messages)['bookmarks'][TABLE]['activity']
+        self.assertEqual(
+            activity['1000']['synced_through'],
+            (self.tap.now - datetime.timedelta(days=7)).strftime(DATE_FORMAT))
+        self.assertEqual(activity['1000']['rows'], [0, 0])
+        self.assertEqual(activity['1001']['synced_through'],
+                         self.tap.now.strftime(DATE_FORMAT))
+
+    def test_dormant_technicians_catch_up(self):
+        messages, _ = self.tap.sync()
+        state = last_state(messages)
+        synced_through = self.tap.now
+
+        # A week later technician 1000 is 14 days behind, past the probe
+        # span, and is fetched from where they were left.
+        self.quiet.clear()
+        self.tap.now += datetime.timedelta(days=7)
+        messages, calls = self.tap.sync(state)
+
+        self.assertEqual(calls['getReport_v2'], 3 * 3)
+
+        caught_up = [parse(record['start_time'])
+                     for record in records(messages, TABLE)
+                     if record['technician_id'] == 1000]
+        self.assertEqual(len(caught_up), self.tap.simulation.rows)
+        self.assertTrue(any(start_time < synced_through
+                            for start_time in caught_up))
+        self.assertTrue(all(
+            start_time > synced_through - datetime.timedelta(days=7)
+            for start_time in caught_up))
+
+        for stream in REPORT_STREAMS:
+            bookmarks = last_state(messages)['bookmarks'][stream]
+            self.assertEqual(bookmarks['activity']['1000']['synced_through'],
+                             bookmarks['start_date'])
+
+    def test_full_sweeps_skip_no_one(self):
+        messages, _ = self.tap.sync()
+        state = last_state(messages)
+
+        self.tap.now += datetime.timedelta(days=1)
+        messages, calls = self.tap.sync(state, config={
+            'activity_full_sweep_days': 0})
+
+        # Technician 1000 is 8 days behind, short of the probe span.
+        self.assertEqual(calls['getReport_v2'], 3 * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
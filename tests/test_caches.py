@@ -0,0 +1,51 @@
+import os
+import unittest
+
+from simulated import SimulatedTap
+
+
+def custom_fields(catalog):
+    schema = catalog.get_stream('session_report').schema.to_dict()
+
+    return sorted(name for name in schema['properties']
+                  if name.startswith('custom_field'))
+
+
+class TestSchemaCache(unittest.TestCase):
+
+    def test_off_by_default(self):
+        tap = SimulatedTap(self)
+        tap.config['schema_cache_path'] = tap.path('schemas.json')
+        tap.discover()
+
+        self.assertFalse(os.path.exists(tap.path('schemas.json')))
+
+    def test_accounts_do_not_share_headers(self):
+        first = SimulatedTap(self, columns=2)
+        second = SimulatedTap(self, columns=3)
+
+        for tap in (first, second):
+            tap.config.update({'schema_cache': True,
+                               'schema_cache_path':
+                                   first.path('schemas.json')})
+
+        self.assertEqual(len(custom_fields(first.discover())), 2)
+        self.assertEqual(len(custom_fields(second.discover())), 3)
+
+
+class TestReportCache(unittest.TestCase):
+
+    def test_accounts_do_not_share_reports(self):
+        first = SimulatedTap(self, technicians=2, days=7)
+        second = SimulatedTap(self, technicians=2, days=7)
+        directory = first.path('reports')
+
+        _, calls = first.sync(config={'report_cache_dir': directory})
+        _, cached_calls = second.sync(config={'report_cache_dir': directory})
+
+        self.assertEqual(cached_calls['getReport_v2'], calls['getReport_v2'])
+        self.assertEqual(len(os.listdir(directory)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import datetime
+import os
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+
+import simulator  # noqa: E402
+
+from tap_logmeinrescue.client import LogMeInRescueClient, \
+    MAX_RELOGIN_DEPTH  # noqa: E402
+
+REPORT_DATE_FORMAT = '%-m/%-d/%Y %H:%M:%S'
+
+
+class TestSessionExpiry(unittest.TestCase):
+
+    def start_simulator(self, **kwargs):
+        simulation = simulator.Simulation(technicians=1, rows=2, **kwargs)
+        server = simulator.start(simulation)
+        self.addCleanup(server.shutdown)
+
+        client = LogMeInRescueClient({
+            'username': 'test@example.com',
+            'password': 'test',
+            'api_base_url': simulator.base_url(server),
+            'retry_base_seconds': 0,
+        })
+        self.addCleanup(client.close)
+
+        return simulation, client
+
+    def fetch_report(self, client, start_date, end_date):
+        client.set_report_area(
+            client.get_url('setReportArea_v8'), 'session_report')
+        client.set_report_setting(
+            client.get_url('setTimezone'), {'timezone': 0})
+        client.set_report_setting(
+            client.get_url('setReportDate_v2'),
+            {'bdate': start_date.strftime(REPORT_DATE_FORMAT),
+             'edate': end_date.strftime(REPORT_DATE_FORMAT)})
+        client.set_report_setting(
+            client.get_url('setOutput'), {'output': 'XML'})
+
+        status, chunks = client.stream_request(
+            client.get_url('getReport_v2'), 'GET',
+            params={'node': 1000, 'nodetype': 'NODE'})
+        self.assertEqual(status, 'OK')
+
+        body = b''.join(
+            chunk if isinstance(chunk, bytes) else chunk.encode('utf-8')
+            for chunk in chunks).decode('utf-8')
+
+        return [datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+                for value in re.findall(
+                    r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}', body)]
+
+    def test_reports_match_their_window_across_session_expiry(self):
+        # Sessions expire every few requests, in the middle of applying
+        # the report settings.
+        _, client = self.start_simulator(session_requests=5)
+        start_date = datetime.datetime(2020, 1, 1)
+
+        for _ in range(8):
+            end_date = start_date + datetime.timedelta(days=7)
+            started = self.fetch_report(client, start_date, end_date)
+
+            self.assertTrue(started)
+
+            for value in started:
+                self.assertTrue(start_date <= value < end_date,
+                                '{} is outside of {} - {}'.format(
+                                    value, start_date, end_date))
+
+            start_date = end_date
+
+    def test_replaying_settings_on_expiring_sessions_gives_up(self):
+        simulation, client = self.start_simulator()
+        start_date = datetime.datetime(2020, 1, 1)
+        end_date = start_date + datetime.timedelta(days=7)
+        self.fetch_report(client, start_date, end_date)
+
+        # From now on sessions expire before all the settings can be
+        # applied to them again.
+        simulation.session_requests = 2
+
+        with self.assertRaisesRegex(Exception, 'NOTLOGGEDIN|in a row'):
+            self.fetch_report(
+                client, end_date, end_date + datetime.timedelta(days=7))
+
+    def test_settings_are_sent_again_for_each_report_area(self):
+        simulation, client = self.start_simulator()
+        timezone_url = client.get_url('setTimezone')
+        area_url = client.get_url('setReportArea_v8')
+
+        for area in (0, 8, 0):
+            client.set_report_area(area_url, area)
+            client.set_report_setting(timezone_url, {'timezone': 0})
+
+        # Area 0 still had the timezone applied when it came back.
+        self.assertEqual(simulation.calls['setTimezone'], 2)
+
+    def test_shared_settings_are_sent_once_per_session(self):
+        simulation, client = self.start_simulator()
+        client.share_report_settings = True
+        timezone_url = client.get_url('setTimezone')
+        area_url = client.get_url('setReportArea_v8')
+
+        for area in (0, 8, 16):
+            client.set_report_area(area_url, area)
+            client.set_report_setting(timezone_url, {'timezone': 0})
+
+        self.assertEqual(simulation.calls['setTimezone'], 1)
+        self.assertEqual(simulation.calls['setReportArea_v8'], 3)
+
+    def test_reports_on_sessions_that_keep_expiring_fail(self):
+        simulation, client = self.start_simulator()
+        handle = simulation.handle
+
+        def expire_reports(endpoint, params, session_id):
+            if endpoint == 'getReport_v2':
+                simulation.calls[endpoint] += 1
+                return 200, 'NOTLOGGEDIN\n\n', None, {}
+
+            return handle(endpoint, params, session_id)
+
+        simulation.handle = expire_reports
+
+        # Not a report status, which would have the window split or the
+        # group fall back to its children.
+        with self.assertRaisesRegex(RuntimeError, 'in a row'):
+            client.stream_request(
+                client.get_url('getReport_v2'), 'GET',
+                params={'node': 1000, 'nodetype': 'NODE'})
+
+        self.assertEqual(simulation.calls['getReport_v2'],
+                         MAX_RELOGIN_DEPTH + 1)
+        self.assertEqual(simulation.calls['login'], MAX_RELOGIN_DEPTH + 1)
+
+    def test_relogin_gives_up_past_the_depth_bound(self):
+        _, client = self.start_simulator()
+        client.relogin_depth = MAX_RELOGIN_DEPTH
+
+        with self.assertRaisesRegex(RuntimeError, 'in a row'):
+            client.relogin('the session expired')
+
+
+if __name__ == '__main__':
+    unittest.main()
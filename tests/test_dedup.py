@@ -0,0 +1,128 @@
+import datetime
+import time
+import unittest
+
+from simulated import SimulatedTap, last_state, records
+
+from tap_logmeinrescue.dedup import DedupIndex
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+REPORT_STREAMS = ('session_report', 'technician_survey_report',
+                  'transferred_sessions_extended_report')
+
+
+def same_rows_every_window(simulation):
+    """Return the same rows for a node whatever the window, as when
+    windows overlap."""
+    report = simulation.report
+
+    def fixed_report(settings, node_id):
+        settings = dict(settings, setReportDate_v2={
+            'bdate': '01/01/2018 00:00:00', 'edate': '01/08/2018 00:00:00'})
+
+        return report(settings, node_id)
+
+    simulation.report = fixed_report
+
+
+def rewind(state, days, now):
+    start_date = (now - datetime.timedelta(days=days)).strftime(DATE_FORMAT)
+
+    for stream in REPORT_STREAMS:
+        state['bookmarks'][stream]['start_date'] = start_date
+
+    return state
+
+
+class TestDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.tap = SimulatedTap(self, technicians=2, days=21)
+        self.tap.config.update({
+            'dedup_index': True,
+            'dedup_index_path': self.tap.path('dedup.json.gz'),
+        })
+        same_rows_every_window(self.tap.simulation)
+
+    def test_rows_emitted_again_are_dropped(self):
+        messages, calls = self.tap.sync()
+
+        # 3 windows with the same rows, emitted once.
+        self.assertEqual(calls['getReport_v2'], 3 * 3 * 2)
+
+        for stream in REPORT_STREAMS:
+            self.assertEqual(len(records(messages, stream)),
+                             2 * self.tap.simulation.rows)
+
+        state = rewind(last_state(messages), 7, self.tap.now)
+        messages, calls = self.tap.sync(state)
+
+        self.assertEqual(calls['getReport_v2'], 3 * 2)
+        self.assertEqual(records(messages, 'session_report'), [])
+
+    def test_rows_of_unsynced_windows_are_emitted_again(self):
+        messages, _ = self.tap.sync()
+
+        # The rows were first emitted in the first window, which the state
+        # no longer counts as synced.
+        state = rewind(last_state(messages), 21, self.tap.now)
+        messages, _ = self.tap.sync(state)
+
+        for stream in REPORT_STREAMS:
+            self.assertEqual(len(records(messages, stream)),
+                             2 * self.tap.simulation.rows)
+
+
+class TestDedupIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tap = SimulatedTap(self)
+
+    def state(self, start_date):
+        return {'bookmarks': {'session_report': {
+            'start_date': start_date.strftime(DATE_FORMAT)}}}
+
+    def test_keeps_the_rows_of_synced_windows(self):
+        path = self.tap.path('dedup.json.gz')
+        first_end = self.tap.now - datetime.timedelta(days=7)
+
+        index = DedupIndex(path)
+        self.assertTrue(index.is_new('session_report', {'id': 1}, first_end))
+        self.assertTrue(index.is_new('session_report', {'id': 2},
+                                     self.tap.now))
+        self.assertFalse(index.is_new('session_report', {'id': 1},
+                                      self.tap.now))
+        index.save()
+
+        index = DedupIndex(path).load(self.state(first_end))
+        self.assertFalse(index.is_new('session_report', {'id': 1},
+                                      self.tap.now))
+        self.assertTrue(index.is_new('session_report', {'id': 2},
+                                     self.tap.now))
+
+    def test_forgets_expired_rows(self):
+        path = self.tap.path('dedup.json.gz')
+
+        index = DedupIndex(path, ttl_hours=1)
+        index.is_new('session_report', {'id': 1}, self.tap.now)
+        index.save()
+
+        index = DedupIndex(path, ttl_hours=1).load(
+            self.state(self.tap.now), now=time.time() + 2 * 3600)
+        self.assertTrue(index.is_new('session_report', {'id': 1},
+                                     self.tap.now))
+
+    def test_forgets_the_rows_seen_least_recently(self):
+        index = DedupIndex(self.tap.path('dedup.json.gz'), max_rows=10)
+        stream = index.streams['session_report']
+
+        for row in range(20):
+            stream.add(row, 0, row)
+
+        stream.evict(10)
+
+        self.assertEqual(list(stream.fingerprints), list(range(10, 20)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from simulated import SimulatedTap, records
+
+TABLE = 'session_report'
+
+
+def row_ids(messages):
+    return sorted(record['session_id'] for record in records(messages, TABLE))
+
+
+class TestGroupFallback(unittest.TestCase):
+
+    def test_large_group_reports_fall_back_to_technicians(self):
+        tap = SimulatedTap(self, technicians=4, technicians_per_group=2,
+                           rows=3, days=7)
+        expected, calls = tap.sync()
+        windows = calls['getReport_v2'] // (3 * 4)
+
+        # Each group report has 6 rows.
+        messages, calls = tap.sync(config={
+            'report_fetch_strategy': 'group',
+            'group_report_max_rows': 5,
+        })
+
+        self.assertEqual(row_ids(messages), row_ids(expected))
+        # 2 groups and then their 4 technicians, for each of 3 streams.
+        self.assertEqual(calls['getReport_v2'], windows * 3 * (2 + 4))
+
+    def test_small_group_reports_are_used(self):
+        tap = SimulatedTap(self, technicians=4, technicians_per_group=2,
+                           rows=3, days=7)
+        expected, calls = tap.sync()
+        windows = calls['getReport_v2'] // (3 * 4)
+
+        messages, calls = tap.sync(config={
+            'report_fetch_strategy': 'group',
+            'group_report_max_rows': 7,
+        })
+
+        self.assertEqual(row_ids(messages), row_ids(expected))
+        self.assertEqual(calls['getReport_v2'], windows * 3 * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+from unittest import mock
+
+from simulated import SimulatedTap, records
+
+BROKEN_NODES = [
+    'Name:No id\nType:Technician\nParentID:10',
+    'NodeID:\nName:Empty id\nType:Technician\nParentID:10',
+    'NodeID:abc\nName:Bad id\nType:Technician\nParentID:10',
+]
+
+
+class TestHierarchy(unittest.TestCase):
+
+    def test_nodes_without_a_usable_id_are_skipped(self):
+        tap = SimulatedTap(self, technicians=2, days=7)
+        hierarchy = tap.simulation.hierarchy
+
+        tap.simulation.hierarchy = lambda: \
+            hierarchy() + '\n\n'.join(BROKEN_NODES) + '\n\n'
+
+        tap.discover()
+
+        with mock.patch('tap_logmeinrescue.hierarchy.LOGGER') as logger:
+            messages, _ = tap.sync()
+
+        self.assertEqual(logger.warning.call_count, len(BROKEN_NODES))
+        self.assertEqual(
+            sorted(record['nodeid']
+                   for record in records(messages, 'technicians')),
+            [1000, 1001])
+        self.assertEqual(
+            {record['technician_id']
+             for record in records(messages, 'session_report')},
+            {1000, 1001})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from simulated import SimulatedTap
+
+
+class TestPlan(unittest.TestCase):
+
+    def assertPlanMatchesSync(self, config):
+        tap = SimulatedTap(self, technicians=5, config=config)
+        planned = tap.plan()['requests']
+        _, calls = tap.sync()
+
+        planned.pop('total')
+
+        self.assertEqual(planned, dict(calls))
+
+    def test_stream_sweep(self):
+        self.assertPlanMatchesSync({})
+
+    def test_combined_sweep(self):
+        self.assertPlanMatchesSync({'report_sweep': 'combined'})
+
+    def test_combined_sweep_in_blocks(self):
+        self.assertPlanMatchesSync({'report_sweep': 'combined',
+                                    'sweep_block_size': 4})
+
+    def test_report_stream_workers(self):
+        self.assertPlanMatchesSync({'report_stream_workers': 3})
+
+    def test_report_workers(self):
+        self.assertPlanMatchesSync({'report_workers': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
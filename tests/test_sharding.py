@@ -0,0 +1,95 @@
+import unittest
+
+from simulated import SimulatedTap, last_state, records
+
+from tap_logmeinrescue.sharding import Shard, merge_states
+
+REPORT_STREAMS = ('session_report', 'technician_survey_report',
+                  'transferred_sessions_extended_report')
+
+
+def node_ids(messages, stream):
+    key = 'nodeid' if stream == 'technicians' else 'technician_id'
+
+    return {int(record[key]) for record in records(messages, stream)}
+
+
+class TestSharding(unittest.TestCase):
+
+    def test_shards_sync_the_whole_account(self):
+        tap = SimulatedTap(self, technicians=5)
+        expected, _ = tap.sync()
+
+        shards = [tap.sync(config={'shard_count': 2, 'shard_index': index})[0]
+                  for index in range(2)]
+
+        for stream in ('technicians',) + REPORT_STREAMS:
+            self.assertEqual(node_ids(shards[0], stream), {1000, 1002, 1004})
+            self.assertEqual(node_ids(shards[1], stream), {1001, 1003})
+            self.assertCountEqual(
+                records(shards[0], stream) + records(shards[1], stream),
+                records(expected, stream))
+
+        merged = merge_states([last_state(messages) for messages in shards])
+
+        for stream in REPORT_STREAMS:
+            shard_bookmarks = [
+                merged['bookmarks']['{}@shard-{}-of-2'.format(stream, index)]
+                for index in range(2)]
+            self.assertEqual(merged['bookmarks'][stream]['start_date'],
+                             shard_bookmarks[0]['start_date'])
+
+        # Everything has been synced, by one shard or the other.
+        messages, calls = tap.sync(merged)
+
+        self.assertEqual(calls['getReport_v2'], 0)
+        self.assertEqual(records(messages, 'session_report'), [])
+
+    def test_shards_start_from_the_unsharded_bookmarks(self):
+        tap = SimulatedTap(self, technicians=4)
+        messages, _ = tap.sync()
+
+        messages, calls = tap.sync(
+            last_state(messages),
+            config={'shard_count': 2, 'shard_index': 1})
+
+        self.assertEqual(calls['getReport_v2'], 0)
+        self.assertEqual(node_ids(messages, 'technicians'), {1001, 1003})
+
+    def test_merging_falls_back_to_the_shard_furthest_behind(self):
+        states = [
+            {'bookmarks': {'session_report@shard-0-of-2': {
+                'start_date': '2018-10-08T00:00:00Z'}}},
+            {'bookmarks': {'session_report@shard-1-of-2': {
+                'start_date': '2018-10-01T00:00:00Z'}}},
+        ]
+
+        merged = merge_states(states)
+
+        self.assertEqual(merged['bookmarks']['session_report'],
+                         {'start_date': '2018-10-01T00:00:00Z'})
+
+        # Without every shard's state, nothing can be resumed unsharded.
+        merged = merge_states(states[:1] + [
+            {'bookmarks': {'session_report@shard-1-of-2': {}}}])
+
+        self.assertNotIn('session_report', merged['bookmarks'])
+
+    def test_shard_config_is_checked(self):
+        self.assertIsNone(Shard.from_config({}))
+
+        for config in ({'shard_count': 2, 'shard_index': 2},
+                       {'shard_count': 2},
+                       {'shard_count': 2, 'shard_index': 0,
+                        'shard_technician_id_min': 1000}):
+            with self.assertRaises(Exception):
+                Shard.from_config(config)
+
+        shard = Shard.from_config({'shard_technician_id_min': 1001,
+                                   'shard_technician_id_max': '1002'})
+        self.assertEqual(shard.select([1000, 1001, 1002, 1003]),
+                         [1001, 1002])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import datetime
+import unittest
+
+from simulated import SimulatedTap, last_state, records
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+TABLE = 'session_report'
+
+
+class TestCombinedSweep(unittest.TestCase):
+
+    def test_matches_the_stream_sweep(self):
+        tap = SimulatedTap(self, technicians=4)
+        messages, _ = tap.sync()
+        combined, _ = tap.sync(config={'report_sweep': 'combined',
+                                       'sweep_block_size': 3})
+
+        for stream in ('session_report', 'technician_survey_report',
+                       'transferred_sessions_extended_report'):
+            self.assertCountEqual(records(messages, stream),
+                                  records(combined, stream))
+
+    def test_catches_up_technicians_left_behind(self):
+        tap = SimulatedTap(self, technicians=3, days=14)
+        messages, _ = tap.sync()
+        state = last_state(messages)
+
+        # An earlier run with the activity index synced the first week and
+        # left technician 1000 a week behind.
+        synced_through = tap.now - datetime.timedelta(days=7)
+        left_behind = synced_through - datetime.timedelta(days=7)
+        state['bookmarks'][TABLE]['start_date'] = \
+            synced_through.strftime(DATE_FORMAT)
+        state['bookmarks'][TABLE]['activity'] = {
+            '1000': {'synced_through': left_behind.strftime(DATE_FORMAT),
+                     'rows': [0, 0, 0, 0]},
+        }
+
+        messages, _ = tap.sync(state, config={'report_sweep': 'combined'})
+
+        caught_up = [record for record in records(messages, TABLE)
+                     if record['technician_id'] == 1000]
+        self.assertTrue(caught_up)
+        self.assertTrue(all(
+            record['start_time'] >= left_behind.strftime(DATE_FORMAT)
+            for record in caught_up))
+        self.assertTrue(any(
+            record['start_time'] < synced_through.strftime(DATE_FORMAT)
+            for record in caught_up))
+
+        bookmarks = last_state(messages)['bookmarks'][TABLE]
+        self.assertEqual(bookmarks['activity']['1000']['synced_through'],
+                         bookmarks['start_date'])
+
+
+if __name__ == '__main__':
+    unittest.main()
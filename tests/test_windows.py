@@ -0,0 +1,93 @@
+import datetime
+import unittest
+
+from dateutil.parser import parse
+
+from simulated import SimulatedTap, records
+
+import simulator
+from tap_logmeinrescue.streams.base import ReportError
+
+TABLE = 'session_report'
+
+
+def fail_long_windows(simulation, node_id, days):
+    """Answer the reports of `node_id` over more than `days` days with an
+    error status, like the API does for reports that are too large."""
+    report = simulation.report
+
+    def limited_report(settings, report_node_id):
+        dates = settings['setReportDate_v2']
+        span = datetime.datetime.strptime(
+            dates['edate'], simulator.REPORT_DATE_FORMAT) - \
+            datetime.datetime.strptime(
+                dates['bdate'], simulator.REPORT_DATE_FORMAT)
+
+        if report_node_id == node_id and span > datetime.timedelta(days=days):
+            return 'REPORT_TOO_LARGE\n\n'
+
+        return report(settings, report_node_id)
+
+    simulation.report = limited_report
+
+
+class TestWindowSplitting(unittest.TestCase):
+
+    def test_failed_reports_are_split(self):
+        tap = SimulatedTap(self, technicians=3, days=7)
+        expected, calls = tap.sync()
+        fail_long_windows(tap.simulation, 1000, days=2)
+
+        messages, split_calls = tap.sync(config={'window_min_days': 1})
+
+        # 7 days fail, so do both halves of 3.5 days, and the four quarters
+        # of 1.75 days each return the rows of a report.
+        self.assertEqual(split_calls['getReport_v2'],
+                         calls['getReport_v2'] + 3 * (2 + 4))
+
+        split = [record for record in records(messages, TABLE)
+                 if record['technician_id'] == 1000]
+        self.assertEqual(len(split), 4 * tap.simulation.rows)
+        start_times = {parse(record['start_time']) for record in split}
+        self.assertEqual(len(start_times), len(split))
+        self.assertTrue(all(
+            tap.now - datetime.timedelta(days=7) < start_time < tap.now
+            for start_time in start_times))
+
+        others = [record for record in records(expected, TABLE)
+                  if record['technician_id'] != 1000]
+        self.assertCountEqual(
+            [record for record in records(messages, TABLE)
+             if record['technician_id'] != 1000], others)
+
+    def test_reports_that_cannot_be_split_fail(self):
+        tap = SimulatedTap(self, technicians=3, days=7)
+        fail_long_windows(tap.simulation, 1000, days=2)
+
+        # The windows are 7 days long at least.
+        with self.assertRaises(ReportError):
+            tap.sync()
+
+    def test_other_errors_are_not_split(self):
+        tap = SimulatedTap(self, technicians=3, days=7)
+        tap.discover()
+        handle = tap.simulation.handle
+
+        def throttled_handle(endpoint, params, session_id):
+            if endpoint == 'getReport_v2' and params.get('node') == '1000':
+                tap.simulation.calls[endpoint] += 1
+                return 429, 'Too many requests', None, {'Retry-After': '0'}
+
+            return handle(endpoint, params, session_id)
+
+        tap.simulation.handle = throttled_handle
+
+        with self.assertRaises(RuntimeError):
+            tap.sync(config={'window_min_days': 1, 'max_retries': 1})
+
+        # The first report, retried once, and no half window.
+        self.assertEqual(tap.simulation.calls['getReport_v2'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()